@@ -0,0 +1,114 @@
+# adaptive.py
+#
+# Precision targeted runs. Instead of a fixed iteration count the sim runs
+# in batches and stops as soon as every tracked statistic reaches the
+# requested standard error, up to a maximum number of iterations.
+#
+# The same batches back progressive runs, which report running estimates
+# with error bars as they go, either through the progress_snapshots
+# generator or as newline delimited JSON on stdout.
+import json
+import sys
+import timeit
+
+import dice
+import stats
+
+
+Z_95 = 1.96
+
+# iterations between clock checks when progress is reported on a timer
+CHECK_SIZE = 1000
+
+
+def add_adaptive_arguments(parser):
+    parser.add_argument('--target_se', type=float, default=None,
+                        help='Stop once every estimate reaches this standard error, --iterations becomes the cap')
+    parser.add_argument('--ci_width', type=float, default=None,
+                        help='Stop once every 95%% confidence interval is narrower than this')
+    parser.add_argument('--batch_size', type=int, help='Iterations between precision checks', default=5000)
+    parser.add_argument('--progress', action='store_true',
+                        help='Print running estimates as JSON lines every --batch_size iterations')
+    parser.add_argument('--progress_seconds', type=float, default=None,
+                        help='Also print running estimates at least this often, implies --progress')
+
+
+def target_std_error(args):
+    # a 95% interval is 2 * 1.96 standard errors wide
+    if args.ci_width is not None:
+        return args.ci_width / (2.0 * Z_95)
+    return args.target_se
+
+
+def iter_adaptive(sample, names, max_iterations, batch_size=5000, seed=None, interval=None):
+    # yields (iterations, accumulators by name) every batch_size iterations,
+    # or every interval seconds if that comes first, and once at the end.
+    # The caller stops the run by breaking out of the loop.
+    if seed is not None:
+        dice.seed(seed)
+    accumulators = [stats.RunningStats() for _ in names]
+    results = dict(zip(names, accumulators))
+    # the clock is only read between chunks to keep timing off the hot loop
+    chunk_size = min(batch_size, CHECK_SIZE) if interval else batch_size
+    iterations = 0
+    since_yield = 0
+    last_yield = timeit.default_timer()
+    while iterations < max_iterations:
+        chunk = min(chunk_size, max_iterations - iterations)
+        for _ in range(chunk):
+            for accumulator, value in zip(accumulators, sample()):
+                accumulator.add(value)
+        iterations += chunk
+        since_yield += chunk
+        if since_yield >= batch_size or iterations >= max_iterations or \
+                (interval and timeit.default_timer() - last_yield >= interval):
+            yield iterations, results
+            since_yield = 0
+            last_yield = timeit.default_timer()
+
+
+def reached_target(results, target_se, scales=None):
+    # target_se applies to the reported values, i.e. after scaling
+    return all(accumulator.std_error * (scales.get(name, 1.0) if scales else 1.0) <= target_se
+               for name, accumulator in results.items())
+
+
+def run_adaptive(sample, names, target_se, max_iterations, batch_size=5000, seed=None, scales=None):
+    # sample() returns one value per name for a single iteration, scales
+    # are the factors the caller reports each name with
+    for iterations, results in iter_adaptive(sample, names, max_iterations, batch_size, seed):
+        if reached_target(results, target_se, scales):
+            break
+    return results
+
+
+def progress_snapshots(sample, names, max_iterations, every=5000, interval=None, seed=None, target_se=None,
+                       scales=None):
+    # running estimates with 95% margins as plain dicts, ready for json
+    start = timeit.default_timer()
+    for iterations, results in iter_adaptive(sample, names, max_iterations, every, seed, interval):
+        converged = target_se is not None and reached_target(results, target_se, scales)
+        estimates = {}
+        for name, accumulator in results.items():
+            scale = scales.get(name, 1.0) if scales else 1.0
+            estimates[name] = {"mean": accumulator.mean * scale, "margin": margin(accumulator, scale)}
+        yield {"iterations": iterations, "elapsed": timeit.default_timer() - start, "estimates": estimates,
+               "done": converged or iterations >= max_iterations}
+        if converged:
+            break
+
+
+def print_progress(snapshots, **fields):
+    # one JSON object per line, extra fields identify the run
+    for snapshot in snapshots:
+        snapshot.update(fields)
+        print json.dumps(snapshot, sort_keys=True)
+        sys.stdout.flush()
+
+
+def margin(accumulator, scale=1.0):
+    return Z_95 * accumulator.std_error * scale
+
+
+def progress_requested(args):
+    return args.progress or args.progress_seconds is not None
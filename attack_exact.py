@@ -0,0 +1,277 @@
+# attack_exact.py
+#
+# Exact evaluation of attack_sim.RulePlan attacks by dynamic programming
+# over the hit dice. The number of 10s fixes Mighty Attack strength up
+# front, then each die is walked in order with the small per-attack state
+# (Screaming Set, Axe Spec, Savage, Beast Knuckles toughness) tracked
+# exactly.
+#
+# Combo Master appends one chain per 10 on every pass, a run of 10s ended
+# by a non-10, so its dice are walked one at a time with the pass, the
+# chains left in it and the 10s so far added to the state. Mighty Attack
+# needs the final count of 10s before the first wound, so the walk is
+# repeated for each total, dropping paths that end with another count.
+# Once strength reaches the toughness every wound table is the same, so
+# all larger totals share one walk, which stops once less than CUTOFF of
+# the chance is left rolling. States under NEGLIGIBLE chance are dropped
+# too, at most CUTOFF of them per walk, so results are exact to float
+# precision. Long chains under double Combo Master can take seconds, so
+# walk_cost estimates the work up front and attacks over MAX_WALK_COST
+# are left to sampling.
+import collections
+
+import stats
+
+
+CUTOFF = 1e-15
+NEGLIGIBLE = 1e-21
+# walk_cost units, a few microseconds each
+MAX_WALK_COST = 200000
+
+
+def unsupported_mods(plan, toughness, max_cost=MAX_WALK_COST):
+    # every rule RulePlan applies is evaluated exactly, but Combo Master
+    # chains too costly to walk are sampled. No max_cost walks anything.
+    unsupported = []
+    if plan.combo_master and max_cost is not None and walk_cost(plan, toughness) > max_cost:
+        unsupported.append("Combo Master")
+    return unsupported
+
+
+def wound_chance(plan, roll, str, toughness):
+    return plan.wound_table(str, toughness)[roll]
+
+
+def wound_outcomes(plan, str, toughness, axe_spec):
+    # chance of each (wounded, wound roll was a 10, axe spec still available)
+    outcomes = collections.defaultdict(float)
+    for roll in range(1, 11):
+        chance = wound_chance(plan, roll, str, toughness)
+        if chance:
+            outcomes[True, roll == 10, axe_spec] += 0.1 * chance
+        if chance == 1.0:
+            continue
+        if not axe_spec:
+            outcomes[False, False, axe_spec] += 0.1 * (1.0 - chance)
+            continue
+        retry = 0.1 * (1.0 - chance) * 0.1
+        for retry_roll in range(1, 11):
+            retry_chance = wound_chance(plan, retry_roll, str, toughness)
+            if retry_chance:
+                outcomes[True, retry_roll == 10, False] += retry * retry_chance
+            if retry_chance < 1.0:
+                outcomes[False, False, False] += retry * (1.0 - retry_chance)
+    return outcomes
+
+
+class ExactResult(object):
+    def __init__(self, distribution, early_iron_failure):
+        # distribution is a stats.JointHistogram weighted by probability
+        self.distribution = distribution
+        self.early_iron_failure = early_iron_failure
+
+    @property
+    def hits(self):
+        return sum(value * chance for value, chance in enumerate(self.distribution.marginal(0)))
+
+    @property
+    def wounds(self):
+        return sum(value * chance for value, chance in enumerate(self.distribution.marginal(1)))
+
+
+def binomial(n, k, p):
+    ways = 1
+    for i in range(k):
+        ways = ways * (n - i) // (i + 1)
+    return ways * p ** k * (1.0 - p) ** (n - k)
+
+
+def hit_outcomes(plan, flags, ten, str):
+    # [(flags after, wounds dealt, chance)] for a hit from flags, the
+    # (Screaming Set, Axe Spec, Savage, toughness) part of the state
+    screaming, axe_spec, savage, toughness = flags
+    if (plan.auto_wound_on_ten and ten) or screaming:
+        return [((False, axe_spec, savage, toughness), 1, 1.0)]
+
+    outcomes = []
+    for (wounded, wound_ten, axe_left), chance in wound_outcomes(plan, str, toughness, axe_spec).items():
+        if not wounded:
+            outcomes.append(((False, axe_left, savage, toughness), 0, chance))
+            continue
+        new_wounds = 1 + plan.devastating
+        new_toughness = toughness - 1 if plan.beast_knuckles else toughness
+        new_savage = savage
+        if savage and wound_ten:
+            new_wounds += 1
+            new_savage = False
+        outcomes.append(((plan.screaming_set, axe_left, new_savage, new_toughness), new_wounds, chance))
+    return outcomes
+
+
+def resolve_hit(plan, prefix, state, chance, ten, str, outcomes, wound_cache):
+    # prefix is the part of the state the hit doesn't change
+    key = (state[:4], ten)
+    if key not in wound_cache:
+        wound_cache[key] = hit_outcomes(plan, state[:4], ten, str)
+    hits = state[4] + 1
+    wounds = state[5]
+    for flags, new_wounds, hit_chance in wound_cache[key]:
+        outcomes[prefix + flags + (hits, wounds + new_wounds)] += chance * hit_chance
+
+
+def walk_speed(plan, state, chance, speed, tens, other_hit_chance, str, wound_cache):
+    # walks the speed dice holding tens 10s, every arrangement equally likely
+    states = {(tens,) + state: chance}
+    for position in range(speed):
+        remaining = speed - position
+        outcomes = collections.defaultdict(float)
+        for state, chance in states.items():
+            tens_left = state[0]
+            if tens_left:
+                resolve_hit(plan, (tens_left - 1,), state[1:], chance * tens_left / remaining, True, str,
+                            outcomes, wound_cache)
+            other_chance = chance * (remaining - tens_left) / remaining
+            if other_chance:
+                if other_hit_chance:
+                    resolve_hit(plan, state[:1], state[1:], other_chance * other_hit_chance, False, str,
+                                outcomes, wound_cache)
+                if other_hit_chance < 1.0:
+                    outcomes[state] += other_chance * (1.0 - other_hit_chance)
+        states = outcomes
+    return dict((state[1:], chance) for state, chance in states.items())
+
+
+def close_chain(plan, combo_pass, chains_left, tens):
+    # (pass, chains left, 10s so far) once a chain's non-10 is rolled, a
+    # finished attack has no chains left
+    if chains_left > 1:
+        return combo_pass, chains_left - 1, tens
+    if combo_pass < plan.combo_master:
+        # the next pass adds a chain for every 10 rolled so far
+        return combo_pass + 1, tens, tens
+    return combo_pass, 0, tens
+
+
+def walk_chains(plan, states, low, high, other_chance, other_hit_chance, str, wound_cache):
+    # walks the Combo Master dice of states keyed (pass, chains left, 10s so
+    # far) + attack state, returning the attack states that end with low to
+    # high 10s. With no high the walk stops once less than CUTOFF of the
+    # chance is still rolling, and in the last pass the count of 10s only
+    # needs to reach low.
+    finished = collections.defaultdict(float)
+    dropped = 0.0
+    while states and (high is not None or sum(states.values()) >= CUTOFF):
+        outcomes = collections.defaultdict(float)
+        for state, chance in states.items():
+            if chance < NEGLIGIBLE and dropped + chance < CUTOFF:
+                dropped += chance
+                continue
+            combo_pass, chains_left, tens = state[:3]
+            if not chains_left:
+                if tens >= low:
+                    finished[state[3:]] += chance
+                continue
+            if high is None and combo_pass == plan.combo_master:
+                tens = min(tens, low)
+            if high is None or tens < high:
+                resolve_hit(plan, (combo_pass, chains_left, tens + 1), state[3:], chance * 0.1, True, str,
+                            outcomes, wound_cache)
+            prefix = close_chain(plan, combo_pass, chains_left, tens)
+            chance *= other_chance
+            if other_hit_chance:
+                resolve_hit(plan, prefix, state[3:], chance * other_hit_chance, False, str, outcomes, wound_cache)
+            if other_hit_chance < 1.0:
+                outcomes[prefix + state[3:]] += chance * (1.0 - other_hit_chance)
+        states = outcomes
+    return finished
+
+
+def dice_chances(plan):
+    # (chance of a non-10, chance a non-10 hits, chance of each count of 10s
+    # among the speed dice)
+    if plan.early_iron:
+        # any 1 fails the attack, otherwise non-10s are uniform on 2-9,
+        # and that includes the dice Combo Master adds
+        faces = range(2, 10)
+    else:
+        faces = range(1, 10)
+    other_chance = len(faces) / 10.0
+    other_hit_chance = sum(1 for face in faces if face != 1 and face >= plan.accuracy) / float(len(faces))
+    # the chance of tens 10s among the speed dice, with no 1 under Early Iron
+    tens_chances = [binomial(plan.speed, tens, 0.1) * (other_chance / 0.9) ** (plan.speed - tens)
+                    for tens in range(plan.speed + 1)]
+    return other_chance, other_hit_chance, tens_chances
+
+
+def mighty_groups(plan, toughness):
+    # (low, high) totals of 10s walked together, each strength on its own
+    # until it reaches the toughness and the wound tables stop changing
+    groups = []
+    low = 0
+    while plan.mighty_attack and plan.strength + plan.mighty_attack * low < toughness:
+        groups.append((low, low))
+        low += 1
+    groups.append((low, None))
+    return groups
+
+
+def start_tens(plan, tens_chances, low, high):
+    # the counts of 10s among the speed dice that can end with low to high
+    for tens in range(plan.speed + 1 if high is None else min(plan.speed, high) + 1):
+        if tens_chances[tens] and (plan.combo_master or tens >= low):
+            yield tens
+
+
+def walk_cost(plan, toughness):
+    # walks only the (pass, chains left, 10s so far) part of each group's
+    # states, weighting each by the square of the dice rolled so far as the
+    # hits and wounds it would be split into
+    other_chance, other_hit_chance, tens_chances = dice_chances(plan)
+    cost = 0
+    for low, high in mighty_groups(plan, toughness):
+        states = collections.defaultdict(float)
+        for tens in start_tens(plan, tens_chances, low, high):
+            states[1, tens if plan.combo_master else 0, tens] += tens_chances[tens]
+        rolled = plan.speed
+        while states and (high is not None or sum(states.values()) >= CUTOFF):
+            outcomes = collections.defaultdict(float)
+            for (combo_pass, chains_left, tens), chance in states.items():
+                if not chains_left:
+                    continue
+                if high is None and combo_pass == plan.combo_master:
+                    tens = min(tens, low)
+                if high is None or tens < high:
+                    outcomes[combo_pass, chains_left, tens + 1] += chance * 0.1
+                outcomes[close_chain(plan, combo_pass, chains_left, tens)] += chance * other_chance
+            states = outcomes
+            rolled += 1
+            cost += len(states) * rolled * rolled
+    return cost
+
+
+def evaluate(plan, toughness, scale=1, max_cost=MAX_WALK_COST):
+    unsupported = unsupported_mods(plan, toughness, max_cost)
+    if unsupported:
+        raise RuntimeError('Exact evaluation does not support: {0}'.format(', '.join(unsupported)))
+
+    speed = plan.speed
+    other_chance, other_hit_chance, tens_chances = dice_chances(plan)
+    distribution = stats.JointHistogram()
+    reached = 0.0
+    for low, high in mighty_groups(plan, toughness):
+        str = plan.strength + plan.mighty_attack * low
+        wound_cache = {}
+        states = collections.defaultdict(float)
+        for tens in start_tens(plan, tens_chances, low, high):
+            chains = tens if plan.combo_master else 0
+            for state, chance in walk_speed(plan, (False, plan.axe_spec, plan.savage, toughness, 0, 0),
+                                            tens_chances[tens], speed, tens, other_hit_chance, str,
+                                            wound_cache).items():
+                states[(1, chains, tens) + state] += chance
+        for state, chance in walk_chains(plan, states, low, high, other_chance, other_hit_chance, str,
+                                         wound_cache).items():
+            distribution.add(state[4] * scale, state[5] * scale, chance)
+            reached += chance
+    early_iron_failure = 1.0 - reached if plan.early_iron else 0.0
+    distribution.add(0, 0, early_iron_failure)
+    return ExactResult(distribution, early_iron_failure)
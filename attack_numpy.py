@@ -0,0 +1,128 @@
+# attack_numpy.py
+#
+# Vectorized NumPy engine for attack_sim. Rolls whole (iterations, speed)
+# dice matrices at once and applies the attack_sim.RulePlan rules as array
+# operations.
+import numpy
+
+import dice
+
+
+CHUNK_SIZE = 65536
+
+
+def roll_matrix(rng, rows, cols):
+    return rng.randint(1, 11, size=(rows, cols))
+
+
+def is_wound_batch(rng, wound_rolls, strength, toughness, sharp, butcher):
+    rows = len(wound_rolls)
+    if sharp:
+        strength = strength + rng.randint(1, 11, size=rows)
+    wound = wound_rolls + strength >= toughness
+    if butcher:
+        wound &= rng.randint(1, 11, size=rows) < 8
+    wound[wound_rolls == 1] = False
+    wound[wound_rolls == 10] = True
+    return wound
+
+
+def apply_combomaster_batch(rng, hit_rolls, valid):
+    count = ((hit_rolls == 10) & valid).sum(axis=1)
+    new_rolls = []
+    new_valid = []
+    while count.any():
+        active = count > 0
+        new_roll = rng.randint(1, 11, size=len(count))
+        new_rolls.append(new_roll)
+        new_valid.append(active)
+        count -= active & (new_roll != 10)
+    if not new_rolls:
+        return hit_rolls, valid
+    return (numpy.column_stack([hit_rolls] + new_rolls),
+            numpy.column_stack([valid] + new_valid))
+
+
+def do_attack_batch(plan, toughness, rows, rng):
+    # toughness is a number or one value per row, the toughness left after
+    # each attack is returned alongside the hits, wounds and Early Iron
+    # failures
+    hit_rolls = roll_matrix(rng, rows, plan.speed)
+    valid = numpy.ones(hit_rolls.shape, dtype=bool)
+    for _ in range(plan.combo_master):
+        hit_rolls, valid = apply_combomaster_batch(rng, hit_rolls, valid)
+
+    tens = ((hit_rolls == 10) & valid).sum(axis=1)
+    strength = plan.strength + plan.mighty_attack * tens
+
+    early_iron = numpy.zeros(rows, dtype=bool)
+    if plan.early_iron:
+        early_iron = ((hit_rolls == 1) & valid).any(axis=1)
+    alive = ~early_iron
+
+    toughness = numpy.array(numpy.broadcast_to(toughness, rows), dtype=int)
+    screaming_auto_wound = numpy.zeros(rows, dtype=bool)
+    axe_spec = numpy.full(rows, plan.axe_spec, dtype=bool)
+    savage = numpy.full(rows, plan.savage, dtype=bool)
+    hits = numpy.zeros(rows, dtype=int)
+    wounds = numpy.zeros(rows, dtype=int)
+    for column in range(hit_rolls.shape[1]):
+        hit_roll = hit_rolls[:, column]
+        hit = valid[:, column] & alive & ((hit_roll == 10) | ((hit_roll != 1) & (hit_roll >= plan.accuracy)))
+        if not hit.any():
+            continue
+        hits += hit
+
+        auto_wound = hit & screaming_auto_wound
+        if plan.auto_wound_on_ten:
+            auto_wound |= hit & (hit_roll == 10)
+        wounds += auto_wound
+        screaming_auto_wound &= ~auto_wound
+        attempt = hit & ~auto_wound
+
+        wound_roll = rng.randint(1, 11, size=rows)
+        wound = is_wound_batch(rng, wound_roll, strength, toughness, plan.sharp, plan.butcher)
+        retry = attempt & ~wound & axe_spec
+        if retry.any():
+            axe_spec &= ~retry
+            retry_roll = rng.randint(1, 11, size=rows)
+            retry_wound = is_wound_batch(rng, retry_roll, strength, toughness, plan.sharp, plan.butcher)
+            wound_roll = numpy.where(retry, retry_roll, wound_roll)
+            wound = numpy.where(retry, retry_wound, wound)
+        wound &= attempt
+
+        wounds += wound * (1 + plan.devastating)
+        if plan.screaming_set:
+            screaming_auto_wound |= wound
+        if plan.beast_knuckles:
+            toughness -= wound
+        savage_wound = wound & savage & (wound_roll == 10)
+        wounds += savage_wound
+        savage &= ~savage_wound
+    return hits, wounds, early_iron, toughness
+
+
+def record_histogram(histogram, hits, wounds):
+    size = histogram.size
+    index = numpy.minimum(hits, size) * (size + 1) + numpy.minimum(wounds, size)
+    histogram.add_counts(numpy.bincount(index, minlength=len(histogram.counts)).tolist())
+
+
+def run_attack_batch(plan, toughness, iterations, rng=None, histogram=None, scale=1):
+    if rng is None:
+        # seeded from the dice stream so parallel shards stay reproducible
+        rng = numpy.random.RandomState(dice.getrandbits(32))
+    cum_hits = 0.0
+    cum_wounds = 0.0
+    cum_context = 0.0
+    remaining = iterations
+    while remaining > 0:
+        rows = min(remaining, CHUNK_SIZE)
+        hits, wounds, context, final_toughness = do_attack_batch(plan, toughness, rows, rng)
+        cum_hits += hits.sum()
+        cum_wounds += wounds.sum()
+        cum_context += context.sum()
+        if histogram is not None:
+            record_histogram(histogram, hits * scale, wounds * scale)
+        remaining -= rows
+    return cum_hits, cum_wounds, cum_context
@@ -2,11 +2,23 @@
 #
 # Monte Carlo sims for calculating optimal dice rolls on attacks
 import argparse
-import copy
-import json
-import random
+import collections
 import sys
 
+import adaptive
+import catalog
+import dice
+import parallel
+import rare_events
+import results
+import stats
+import wound_tables
+
+
+# Bump whenever a rules change alters simulated results, so cached results
+# from older rules stop matching
+SIM_VERSION = 3
+
 
 class Weapon(object):
     def __init__(self, name, json_obj):
@@ -18,10 +30,10 @@ class Weapon(object):
         if "special mods" in json_obj:
             self.special_mods = json_obj["special mods"]
 
-    def print_info(self):
-        print 'Using weapon \"{0}\" {1}/{2}/{3}'.format(self.name, self.speed, self.accuracy, self.strength)
+    def print_info(self, out=None):
+        print >> out, 'Using weapon \"{0}\" {1}/{2}/{3}'.format(self.name, self.speed, self.accuracy, self.strength)
         if self.special_mods:
-            print 'Weapon properties: [\"{0}\"]'.format('\", \"'.join(self.special_mods))
+            print >> out, 'Weapon properties: [\"{0}\"]'.format('\", \"'.join(self.special_mods))
 
 
 class Character(object):
@@ -49,167 +61,447 @@ class Character(object):
     def strength(self):
         return self.base_strength + self.extra_strength
 
-    def print_info(self):
-        print 'Using character \"{0}\" +{1} spd, +{2} acc, +{3} str'.format(self.name, self.base_speed,
-                                                                            self.base_accuracy, self.base_strength)
+    def print_info(self, out=None):
+        print >> out, 'Using character \"{0}\" +{1} spd, +{2} acc, +{3} str'.format(self.name, self.base_speed,
+                                                                                   self.base_accuracy,
+                                                                                   self.base_strength)
         if self.base_speed or self.base_accuracy or self.strength:
-            print 'Bonus +{0} spd, +{1} acc, +{2} str'.format(self.extra_speed, self.extra_accuracy,
-                                                              self.extra_strength)
+            print >> out, 'Bonus +{0} spd, +{1} acc, +{2} str'.format(self.extra_speed, self.extra_accuracy,
+                                                                      self.extra_strength)
         if self.fighting_arts:
-            print 'Using fighting arts: [\"{0}\"]'.format('\", \"'.join(self.fighting_arts))
-
-
-def is_wound(roll, weapon, str, toughness, extra_mods):
-    if roll == 1:
-        return False
-    if roll == 10:
-        return True
-    if "Sharp" in weapon.special_mods:
-        str += random.randint(1, 10)
-    wound = roll + str >= toughness
-    if wound and "Butcher lv3" in extra_mods:
-        butcher_roll = random.randint(1, 10)
-        if butcher_roll >= 8:
-            wound = False
-    return wound
+            print >> out, 'Using fighting arts: [\"{0}\"]'.format('\", \"'.join(self.fighting_arts))
 
 
 def is_hit(roll, acc):
-    return roll == 10 or (roll != 1 and (roll >= acc))
+    return wound_tables.hit_table(acc)[roll]
 
 
 def apply_combomaster(roll):
     count = roll.count(10)
     while count > 0:
-        new_roll = random.randint(1, 10)
+        new_roll = dice.d10()
         roll.append(new_roll)
         if new_roll != 10:
             count -= 1
 
 
-def roll_n_dice(n):
-    roll = []
-    for _ in range(n):
-        roll.append(random.randint(1, 10))
-    return roll
-
-
 def load_weapon_data(weapon):
-    with open("weapon_data.json", "r") as read_file:
-        data = json.load(read_file)
-        if weapon not in data:
-            raise RuntimeError('Weapon not found in weapon_data.json: {0}'.format(weapon))
-        return Weapon(weapon, data[weapon])
-    return None
+    return Weapon(weapon, catalog.default_catalog().weapon_data(weapon))
 
 
 def load_character_data(character):
-    with open("characters.json", "r") as read_file:
-        data = json.load(read_file)
-        if character not in data:
-            raise RuntimeError('Character not found in characters.json: {0}'.format(character))
-        return Character(character, data[character])
-    return None
+    return Character(character, catalog.default_catalog().character_data(character))
 
 
-def do_one_attack(weapon, character, toughness, extra_mods):
-    spd = weapon.speed + character.speed
-    str = weapon.strength + character.strength
-    acc = weapon.accuracy - character.accuracy
+def apply_extra_mods(weapon, character, extra_mods):
+    # Adjusts weapon and character stats for the extra mods and fighting arts
+    # in play, returning warnings for any that don't apply to the weapon
+    warnings = []
+    if "Grand Spec" in extra_mods or "Grand Spec" in character.fighting_arts:
+        if "Grand Weapon" not in weapon.special_mods:
+            warnings.append("Grand Spec specified but weapon is not a Grand Weapon")
+        else:
+            character.extra_accuracy += 1
 
-    screaming_auto_wound = False
-    savage = "Savage" in weapon.special_mods
-    axe_spec = False
     if "Axe Spec" in extra_mods or "Axe Spec" in character.fighting_arts:
-        if "Axe" in weapon.special_mods:
-            axe_spec = True
-
-    hit_rolls = roll_n_dice(spd)
-    if "Combo Master" in weapon.special_mods:
-        apply_combomaster(hit_rolls)
-    # TODO: Does Combo Master stack?
-    if "Combo Master" in character.fighting_arts:
-        apply_combomaster(hit_rolls)
-
-    if "Mighty Attack 1" in weapon.special_mods:
-        for _ in range(hit_rolls.count(10)):
-            str += 2
-    if "Mighty Attack 1" in character.fighting_arts:
-        for _ in range(hit_rolls.count(10)):
-            str += 2
-    if "Mighty Attack 2" in weapon.special_mods:
-        for _ in range(hit_rolls.count(10)):
-            str += 4
-
-    if "Early Iron" in weapon.special_mods and 1 in hit_rolls:
-        return 0.0, 0.0, 1.0
-
-    hits = 0.0
-    wounds = 0.0
-    for hit_roll in hit_rolls:
-        if is_hit(hit_roll, acc):
+        if "Axe" not in weapon.special_mods:
+            warnings.append("Axe Spec specified but weapon is not a Axe")
+
+    if "White Lion Set" in extra_mods or "White Lion Set" in character.fighting_arts:
+        if "Dagger" not in weapon.special_mods and "Katar" not in weapon.special_mods:
+            warnings.append("White Lion Set specified but no Dagger or Katar equipped")
+        else:
+            character.extra_strength += 2
+            character.extra_speed += 1
+
+    if "Paired" in extra_mods:
+        if "Paired" not in weapon.special_mods:
+            warnings.append("Paired specified but supplied weapon does not support Paired")
+        else:
+            weapon.speed *= 2
+
+    if "Strategist" in extra_mods or "Strategist" in character.fighting_arts:
+        if "Bow" not in weapon.special_mods:
+            warnings.append("Strategist specified but bow weapon not equipped")
+        else:
+            character.extra_accuracy += 2
+
+    if "Screaming Set" in extra_mods or "Screaming Set" in character.fighting_arts:
+        if "Spear" not in weapon.special_mods:
+            warnings.append("Screaming Set specified but spear weapon not equipped")
+    return warnings
+
+
+# Post-wound effect hooks. Each is called with the plan, the per-attack
+# state and the wound roll after a successful wound and returns any extra
+# wounds. Hooks run in the order the plan lists them.
+def devastating_hook(plan, state, wound_roll):
+    return plan.devastating
+
+
+def screaming_set_hook(plan, state, wound_roll):
+    # this wound result may be applied to next wound attempt
+    state.screaming_auto_wound = True
+    return 0.0
+
+
+def beast_knuckles_hook(plan, state, wound_roll):
+    # -1 toughness for rest of attack per wound
+    state.toughness -= 1
+    return 0.0
+
+
+def savage_hook(plan, state, wound_roll):
+    if state.savage and wound_roll == 10:
+        # savage can only activate once per attack
+        state.savage = False
+        return 1.0
+    return 0.0
+
+
+class AttackState(object):
+    __slots__ = ("toughness", "screaming_auto_wound", "axe_spec", "savage")
+
+    def __init__(self, plan, toughness):
+        self.toughness = toughness
+        self.screaming_auto_wound = False
+        self.axe_spec = plan.axe_spec
+        self.savage = plan.savage
+
+
+class RulePlan(object):
+    # Weapon, character and extra mods compiled once into flags, adjusted
+    # stats and the ordered post-wound hooks that actually apply, so the
+    # attack loop never scans the mod lists
+    def __init__(self, weapon, character, extra_mods):
+        weapon_mods = weapon.special_mods
+        arts = character.fighting_arts
+
+        self.speed = weapon.speed + character.speed
+        self.accuracy = weapon.accuracy - character.accuracy
+        self.strength = weapon.strength + character.strength
+
+        # TODO: Does Combo Master stack?
+        self.combo_master = ("Combo Master" in weapon_mods) + ("Combo Master" in arts)
+        self.mighty_attack = 0
+        if "Mighty Attack 1" in weapon_mods:
+            self.mighty_attack += 2
+        if "Mighty Attack 1" in arts:
+            self.mighty_attack += 2
+        if "Mighty Attack 2" in weapon_mods:
+            self.mighty_attack += 4
+        self.early_iron = "Early Iron" in weapon_mods
+
+        self.sharp = "Sharp" in weapon_mods
+        self.butcher = "Butcher lv3" in extra_mods
+        self.auto_wound_on_ten = "Counterweighted Axe" in weapon_mods or "Acid Tooth Dagger" in weapon_mods
+        self.axe_spec = ("Axe Spec" in extra_mods or "Axe Spec" in arts) and "Axe" in weapon_mods
+        self.savage = "Savage" in weapon_mods
+        self.devastating = 0
+        if "Devastating 1" in weapon_mods:
+            self.devastating += 1
+        if "Devastating 2" in weapon_mods:
+            self.devastating += 2
+        self.screaming_set = "Screaming Set" in arts or "Screaming Set" in extra_mods
+        self.beast_knuckles = "Beast Knuckles" in weapon_mods
+
+        self.wound_hooks = []
+        if self.devastating:
+            self.wound_hooks.append(devastating_hook)
+        if self.screaming_set:
+            self.wound_hooks.append(screaming_set_hook)
+        if self.beast_knuckles:
+            self.wound_hooks.append(beast_knuckles_hook)
+        if self.savage:
+            self.wound_hooks.append(savage_hook)
+
+        # per face hit chances, and wound chances by (strength, toughness)
+        # taken from the shared wound_tables cache the first time they're used
+        self.hit_faces = wound_tables.hit_table(self.accuracy)
+        self.wound_chances = {}
+
+    def roll_hit_dice(self):
+        hit_rolls = dice.roll_n_dice(self.speed)
+        for _ in range(self.combo_master):
+            apply_combomaster(hit_rolls)
+
+        str = self.strength
+        if self.mighty_attack:
+            str += self.mighty_attack * hit_rolls.count(10)
+
+        early_iron_failure = self.early_iron and 1 in hit_rolls
+        return hit_rolls, str, early_iron_failure
+
+    def wound_table(self, str, toughness):
+        chances = self.wound_chances.get((str, toughness))
+        if chances is None:
+            chances = wound_tables.wound_table(str, toughness, self.sharp, self.butcher)
+            self.wound_chances[str, toughness] = chances
+        return chances
+
+    def is_wound(self, roll, str, toughness):
+        # Sharp and Butcher lv3 dice are folded into the chance, so a roll
+        # that isn't settled by its face takes a single uniform draw
+        chances = self.wound_chances.get((str, toughness))
+        if chances is None:
+            chances = self.wound_table(str, toughness)
+        chance = chances[roll]
+        if chance == 1.0:
+            return True
+        if chance == 0.0:
+            return False
+        return dice.uniform() < chance
+
+    def resolve_wounds(self, hit_rolls, str, toughness, state=None):
+        # Everything after the hit roll; toughness only matters from here on
+        # so one set of hit dice can be resolved against several toughnesses.
+        # A caller can pass its own AttackState to see the toughness left
+        # afterwards, e.g. to carry Beast Knuckles into the next attack.
+        if state is None:
+            state = AttackState(self, toughness)
+        hit_faces = self.hit_faces
+        hits = 0.0
+        wounds = 0.0
+        for hit_roll in hit_rolls:
+            if not hit_faces[hit_roll]:
+                continue
             hits += 1.0
-            if (("Counterweighted Axe" in weapon.special_mods or "Acid Tooth Dagger" in weapon.special_mods) and hit_roll == 10) or screaming_auto_wound:
-                screaming_auto_wound = False
+            if (self.auto_wound_on_ten and hit_roll == 10) or state.screaming_auto_wound:
+                state.screaming_auto_wound = False
                 wounds += 1.0
                 continue
-            wound_roll = random.randint(1, 10)
-            if not is_wound(wound_roll, weapon, str, toughness, extra_mods):
-                if axe_spec:
-                    axe_spec = False
-                    wound_roll = random.randint(1, 10)
-                    if not is_wound(wound_roll, weapon, str, toughness, extra_mods):
-                        continue
-                else:
+            wound_roll = dice.d10()
+            if not self.is_wound(wound_roll, str, state.toughness):
+                if not state.axe_spec:
+                    continue
+                state.axe_spec = False
+                wound_roll = dice.d10()
+                if not self.is_wound(wound_roll, str, state.toughness):
                     continue
 
             wounds += 1.0
-            if "Devastating 1" in weapon.special_mods:
-                wounds += 1
-            if "Devastating 2" in weapon.special_mods:
-                wounds += 2
-            if "Screaming Set" in character.fighting_arts or "Screaming Set" in extra_mods:
-                # this wound result may be applied to next wound attempt
-                screaming_auto_wound = True
-            if "Beast Knuckles" in weapon.special_mods:
-                # -1 toughness for rest of attack per wound
-                toughness -= 1
-            if savage and wound_roll == 10:
-                wounds += 1.0
-                # savage can only activate once per attack
-                savage = False
-    return hits, wounds, 0.0
+            for hook in self.wound_hooks:
+                wounds += hook(self, state, wound_roll)
+        return hits, wounds
 
+    def attack(self, toughness):
+        hit_rolls, str, early_iron_failure = self.roll_hit_dice()
+        if early_iron_failure:
+            return 0.0, 0.0, 1.0
+        hits, wounds = self.resolve_wounds(hit_rolls, str, toughness)
+        return hits, wounds, 0.0
 
-def run_attack_sim(weapon, character, toughness, extra_mods, iterations):
-    cum_hit_avg = 0.0
-    cum_wound_avg = 0.0
-    cum_context = 0.0
-    for iteration in range(iterations):
-        hits, wounds, context = do_one_attack(weapon, character, toughness, extra_mods)
-
-        cum_context += context
-        if iteration == 0:
-            cum_hit_avg = hits
-            cum_wound_avg = wounds
-        elif iteration == 1:
-            cum_hit_avg = (hits + cum_hit_avg) / 2
-            cum_wound_avg = (wounds + cum_wound_avg) / 2
-        elif iteration >= 2:
-            # Cumulative moving average
-            cum_hit_avg = (cum_hit_avg * iteration + hits) / (iteration + 1)
-            cum_wound_avg = (cum_wound_avg * iteration + wounds) / (iteration + 1)
 
+def do_one_attack(weapon, character, toughness, extra_mods):
+    return RulePlan(weapon, character, extra_mods).attack(toughness)
+
+
+def attack_totals(weapon, character, toughness, extra_mods, engine, iterations):
+    if engine == "instrumented":
+        # Imported lazily so the plain loop never touches the counters
+        import instrument
+        plan = instrument.InstrumentedRulePlan(weapon, character, extra_mods)
+    else:
+        plan = RulePlan(weapon, character, extra_mods)
+    # the distribution is recorded on the same scale as the reported means
+    scale = 2 if "Painted" in extra_mods else 1
+    distribution = stats.JointHistogram()
+    if engine == "numpy":
+        # Imported lazily so numpy is only required for the vectorized engine
+        import attack_numpy
+        hits, wounds, context = attack_numpy.run_attack_batch(plan, toughness, iterations, histogram=distribution,
+                                                              scale=scale)
+        return {"hits": hits, "wounds": wounds, "context": context, "distribution": distribution}
+
+    # outcomes are tallied per distinct (hits, wounds, context) result in
+    # the loop and folded into the sums and histogram once at the end
+    outcome_counts = collections.defaultdict(int)
+    for _ in range(iterations):
+        outcome_counts[plan.attack(toughness)] += 1
+    cum_hits = 0.0
+    cum_wounds = 0.0
+    cum_context = 0.0
+    for (hits, wounds, context), count in outcome_counts.items():
+        cum_hits += hits * count
+        cum_wounds += wounds * count
+        cum_context += context * count
+        distribution.add(hits * scale, wounds * scale, count)
+    totals = {"hits": cum_hits, "wounds": cum_wounds, "context": cum_context, "distribution": distribution}
+    if engine == "instrumented":
+        totals["instrumentation"] = plan.instrumentation()
+    return totals
+
+
+def attack_totals_by_toughness(weapon, character, toughnesses, extra_mods, iterations):
+    # Hit rolls don't depend on toughness, so each iteration rolls them once
+    # and resolves the wound phase against every requested toughness
+    hit_totals = {}
+    wound_totals = {}
+    for toughness in toughnesses:
+        hit_totals[toughness] = 0.0
+        wound_totals[toughness] = 0.0
+    plan = RulePlan(weapon, character, extra_mods)
+    cum_context = 0.0
+    for _ in range(iterations):
+        hit_rolls, str, early_iron_failure = plan.roll_hit_dice()
+        if early_iron_failure:
+            cum_context += 1.0
+            continue
+        for toughness in toughnesses:
+            hits, wounds = plan.resolve_wounds(hit_rolls, str, toughness)
+            hit_totals[toughness] += hits
+            wound_totals[toughness] += wounds
+    return {"hits": hit_totals, "wounds": wound_totals, "context": cum_context}
+
+
+def expected_results(hits, wounds, iterations, extra_mods):
+    hit_avg = hits / iterations
+    wound_avg = wounds / iterations
     if "Painted" in extra_mods:
-        cum_hit_avg *= 2
-        cum_wound_avg *= 2
+        hit_avg *= 2
+        wound_avg *= 2
+    return hit_avg, wound_avg
+
+
+def attack_record(weapon, character, toughness, extra_mods, method, iterations, hits, wounds, early_iron_failure):
+    # one row for results.ResultWriter
+    return [("sim", "attack"), ("weapon", weapon.name), ("character", character.name),
+            ("bonus_speed", character.extra_speed), ("bonus_strength", character.extra_strength),
+            ("extra_mods", ", ".join(mod for mod in extra_mods if mod)), ("toughness", toughness),
+            ("method", method), ("iterations", iterations), ("hits", hits), ("wounds", wounds),
+            ("early_iron_failure", early_iron_failure)]
+
+
+def run_attack_adaptive(weapon, character, toughness, extra_mods, target_se, max_iterations, batch_size, seed,
+                        writer=None):
+    plan = RulePlan(weapon, character, extra_mods)
+    scale = 2.0 if "Painted" in extra_mods else 1.0
+    results = adaptive.run_adaptive(lambda: plan.attack(toughness),
+                                    ("hits", "wounds", "context"), target_se, max_iterations, batch_size, seed,
+                                    {"hits": scale, "wounds": scale})
+    hits = results["hits"]
+    wounds = results["wounds"]
+    print 'T{0} - Expected hits: {1:.2f} +/- {2:.2f}, wounds: {3:.2f} +/- {4:.2f} after {5} iterations'.format(
+        toughness, hits.mean * scale, adaptive.margin(hits, scale), wounds.mean * scale,
+        adaptive.margin(wounds, scale), wounds.count)
+    if "Early Iron" in weapon.special_mods:
+        context = results["context"]
+        print "Early Iron failure rate: {0:.2f} +/- {1:.2f}".format(context.mean * 100.0,
+                                                                    adaptive.margin(context, 100.0))
+    if writer:
+        writer.add(attack_record(weapon, character, toughness, extra_mods, "adaptive", wounds.count,
+                                 hits.mean * scale, wounds.mean * scale, results["context"].mean))
+
+
+def run_attack_rare(weapon, character, toughness, extra_mods, iterations, min_wounds, early_iron, pilot, rounds,
+                    seed=None):
+    # importance sampled chance of at least min_wounds wounds, or of an
+    # Early Iron failure, from one attack
+    plan = RulePlan(weapon, character, extra_mods)
+    scale = 2.0 if "Painted" in extra_mods else 1.0
+    if early_iron:
+        label = 'T{0} - Early Iron failure chance'.format(toughness)
+        score = lambda outcome: outcome[2]
+        threshold = 1.0
+    else:
+        label = 'T{0} - Chance of {1}+ wounds'.format(toughness, min_wounds)
+        score = lambda outcome: outcome[1] * scale
+        threshold = min_wounds
+    accumulator, used_rounds = rare_events.estimate(lambda: plan.attack(toughness), score, threshold, iterations,
+                                                    pilot, rounds, seed)
+    rare_events.print_estimate(label, accumulator, iterations, pilot, used_rounds)
+
+
+def run_attack_progressive(weapon, character, toughness, extra_mods, max_iterations, every, interval, seed,
+                           target_se=None):
+    plan = RulePlan(weapon, character, extra_mods)
+    scale = 2.0 if "Painted" in extra_mods else 1.0
+    snapshots = adaptive.progress_snapshots(lambda: plan.attack(toughness), ("hits", "wounds", "context"),
+                                            max_iterations, every, interval, seed, target_se,
+                                            {"hits": scale, "wounds": scale})
+    adaptive.print_progress(snapshots, sim="attack", weapon=weapon.name, character=character.name,
+                            toughness=toughness)
+
+
+def print_distribution(distribution):
+    for axis, label in ((0, "hits"), (1, "wounds")):
+        chances = distribution.exceedance(axis)
+        # exact tails run down to ~1e-21, stop where they'd print as 0.00%
+        largest = max(value for value, chance in enumerate(chances) if value == 0 or chance >= 0.00005)
+        print '  P({0} >= k): {1}'.format(label, ', '.join('{0}: {1:.2f}%'.format(value, chances[value] * 100.0)
+                                                            for value in range(1, largest + 1)))
+        print '  {0} percentiles: 10th {1}, median {2}, 90th {3}'.format(
+            label, distribution.percentile(axis, 0.1), distribution.percentile(axis, 0.5),
+            distribution.percentile(axis, 0.9))
+
+
+def run_attack_exact(weapon, character, toughness, extra_mods, show_distribution=False, writer=None):
+    # returns False when the plan needs sampling instead
+    import attack_exact
+    plan = RulePlan(weapon, character, extra_mods)
+    unsupported = attack_exact.unsupported_mods(plan, toughness)
+    if unsupported:
+        print 'Exact evaluation does not support [\"{0}\"], sampling instead'.format('\", \"'.join(unsupported))
+        return False
+
+    result = attack_exact.evaluate(plan, toughness, 2 if "Painted" in extra_mods else 1)
+    print 'T{0} - Expected hits: {1:.2f}, wounds: {2:.2f}'.format(toughness, result.hits, result.wounds)
+    if "Early Iron" in weapon.special_mods:
+        print "Early Iron failure rate: {0:.2f}".format(result.early_iron_failure * 100.0)
+    if show_distribution:
+        print_distribution(result.distribution)
+    if writer:
+        writer.add(attack_record(weapon, character, toughness, extra_mods, "exact", 0, result.hits, result.wounds,
+                                 result.early_iron_failure))
+    return True
+
+
+def attack_config(weapon, character, toughness, extra_mods, engine, seed):
+    # everything that can change the simulated totals, resolved to values
+    return {
+        "sim": "attack",
+        "version": SIM_VERSION,
+        "weapon": [weapon.name, weapon.speed, weapon.accuracy, weapon.strength, sorted(weapon.special_mods)],
+        "character": [character.name, character.speed, character.accuracy, character.strength,
+                      sorted(character.fighting_arts)],
+        "toughness": toughness,
+        "extra_mods": sorted(set(extra_mods)),
+        "engine": engine,
+        "seed": seed,
+    }
+
+
+def run_attack_sim(weapon, character, toughness, extra_mods, iterations, engine="python", workers=1, seed=None,
+                   target_se=None, batch_size=5000, show_distribution=False, cache=None, writer=None):
+    if target_se:
+        run_attack_adaptive(weapon, character, toughness, extra_mods, target_se, iterations, batch_size, seed,
+                            writer)
+        return
+
+    args = (weapon, character, toughness, extra_mods, engine)
+    if cache:
+        totals, iterations = cache.run(attack_config(weapon, character, toughness, extra_mods, engine, seed),
+                                       attack_totals, args, iterations, workers, seed)
+    else:
+        totals = parallel.run_sharded(attack_totals, args, iterations, workers, seed)
+    cum_hit_avg, cum_wound_avg = expected_results(totals["hits"], totals["wounds"], iterations, extra_mods)
+    cum_context = totals["context"]
+
     print 'T{0} - Expected hits: {1:.2f}, wounds: {2:.2f}'.format(toughness, cum_hit_avg, cum_wound_avg)
     # print contextual data
     if "Early Iron" in weapon.special_mods:
         print "Early Iron failure rate: {0:.2f}".format(cum_context / iterations * 100.0)
+    if show_distribution:
+        print_distribution(totals["distribution"])
+    if "instrumentation" in totals:
+        import instrument
+        instrument.print_instrumentation(totals["instrumentation"])
+    if writer:
+        writer.add(attack_record(weapon, character, toughness, extra_mods, "sampled", iterations, cum_hit_avg,
+                                 cum_wound_avg, cum_context / iterations))
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(prog="attack_sim", description='Calculate dice rolls for KD:M',
                                      add_help=True)
     parser.add_argument('weapon', type=str, help='The name of the weapon to run the sim on')
@@ -219,92 +511,94 @@ def main():
     parser.add_argument('--iterations', type=int, help='The number of iterations to run',
                         default=100000)
     parser.add_argument('--toughness', type=int, help='The toughness of the monster', default=0)
+    parser.add_argument('--engine', type=str, choices=['python', 'numpy', 'instrumented'], default='python',
+                        help='Simulation engine to use, instrumented also reports rule activations and stage times')
+    parser.add_argument('--workers', type=int, help='The number of worker processes to shard iterations across',
+                        default=1)
+    parser.add_argument('--seed', type=int, help='Seed for reproducible runs', default=None)
     parser.add_argument('--butcher', type=int, help='Special mode for calculating Butcher lv3 fight', default=0)
     parser.add_argument('--extra_mods', type=str, help='CSV list of extra mods. e.g. \"Axe Spec, Spear Mastery\"',
                         default='')
-
-    args = parser.parse_args()
+    parser.add_argument('--exact', action='store_true',
+                        help='Compute exact results where the rules allow, sampling otherwise')
+    parser.add_argument('--distribution', action='store_true',
+                        help='Print exceedance chances and percentiles of hits and wounds')
+    adaptive.add_adaptive_arguments(parser)
+    parser.add_argument('--rare_wounds', type=int, default=0,
+                        help='Estimate the chance of at least this many wounds by importance sampling')
+    parser.add_argument('--rare_early_iron', action='store_true',
+                        help='Estimate the chance of an Early Iron failure by importance sampling')
+    rare_events.add_rare_arguments(parser)
+    parser.add_argument('--cache_dir', type=str, help='Reuse and extend results cached in this directory',
+                        default=None)
+    parser.add_argument('--cache_size', type=int, help='The maximum number of cached results to keep',
+                        default=1000)
+    results.add_output_arguments(parser)
+
+    args = parser.parse_args(argv)
+    # only plain sampled runs go through the engines and worker processes
+    modes = [flag for flag, used in (("--exact", args.exact),
+                                     ("--rare_wounds/--rare_early_iron", args.rare_wounds or args.rare_early_iron),
+                                     ("--progress", adaptive.progress_requested(args)),
+                                     ("--target_se/--ci_width", adaptive.target_std_error(args))) if used]
+    if modes and (args.engine != "python" or args.workers != 1):
+        parser.error('--engine and --workers are not supported with {0}'.format(', '.join(modes)))
+    cache = None
+    if args.cache_dir:
+        import result_cache
+        cache = result_cache.ResultCache(args.cache_dir, args.cache_size)
+    writer = results.open_writer(args)
 
     weapon = load_weapon_data(args.weapon)
     character = load_character_data(args.character)
     extra_mods = args.extra_mods.split(',')
+    # progress runs keep stdout to the JSON lines
+    out = sys.stderr if adaptive.progress_requested(args) else sys.stdout
     if weapon and character:
         if extra_mods:
-            print 'Using extra modifiers: [\"{0}\"]'.format('\", \"'.join(extra_mods))
-        if "Grand Spec" in extra_mods or "Grand Spec" in character.fighting_arts:
-            if "Grand Weapon" not in weapon.special_mods:
-                print "WARNING: Grand Spec specified but weapon is not a Grand Weapon"
-            else:
-                character.extra_accuracy += 1
-
-        if "Axe Spec" in extra_mods or "Axe Spec" in character.fighting_arts:
-            if "Axe" not in weapon.special_mods:
-                print "WARNING: Axe Spec specified but weapon is not a Axe"
-
-        if "White Lion Set" in extra_mods or "White Lion Set" in character.fighting_arts:
-            if "Dagger" not in weapon.special_mods and "Katar" not in weapon.special_mods:
-                print "WARNING: White Lion Set specified but no Dagger or Katar equipped"
-            else:
-                character.extra_strength += 2
-                character.extra_speed += 1
-
-        if "Paired" in extra_mods:
-            if "Paired" not in weapon.special_mods:
-                print "WARNING: Paired specified but supplied weapon does not support Paired"
-            else:
-                weapon.speed *= 2
-
-        if "Strategist" in extra_mods or "Strategist" in character.fighting_arts:
-            if "Bow" not in weapon.special_mods:
-                print "WARNING: Strategist specified but bow weapon not equipped"
-            else:
-                character.extra_accuracy += 2
-
-        if "Screaming Set" in extra_mods or "Screaming Set" in character.fighting_arts:
-            if "Spear" not in weapon.special_mods:
-                print "WARNING: Screaming Set specified but spear weapon not equipped"
-
-        character.print_info()
-        weapon.print_info()
+            print >> out, 'Using extra modifiers: [\"{0}\"]'.format('\", \"'.join(extra_mods))
+        for warning in apply_extra_mods(weapon, character, extra_mods):
+            print >> out, "WARNING: {0}".format(warning)
+
+        character.print_info(out)
+        weapon.print_info(out)
+
+        def run(toughness):
+            if args.rare_wounds or args.rare_early_iron:
+                run_attack_rare(weapon, character, toughness, extra_mods, args.iterations, args.rare_wounds,
+                                args.rare_early_iron, args.rare_pilot, args.rare_rounds, args.seed)
+                return
+            if args.exact and run_attack_exact(weapon, character, toughness, extra_mods, args.distribution, writer):
+                return
+            if adaptive.progress_requested(args):
+                run_attack_progressive(weapon, character, toughness, extra_mods, args.iterations, args.batch_size,
+                                       args.progress_seconds, args.seed, adaptive.target_std_error(args))
+                return
+            run_attack_sim(weapon, character, toughness, extra_mods, args.iterations, args.engine, args.workers,
+                           args.seed, adaptive.target_std_error(args), args.batch_size, args.distribution, cache,
+                           writer)
 
         if args.toughness:
-            run_attack_sim(weapon, character, args.toughness, extra_mods, args.iterations)
+            run(args.toughness)
         elif args.butcher:
             extra_mods.append("Butcher lv3")
 
-            print "Butcher lv3 base:"
-            run_attack_sim(weapon, character, 15, extra_mods, args.iterations)
-
-            print "Butcher lv3 frenzy 1:"
-            character.extra_speed += 1
-            character.extra_strength += 1
-            run_attack_sim(weapon, character, 15, extra_mods, args.iterations)
-
-            print "Butcher lv3 frenzy 2:"
-            character.extra_speed += 1
-            character.extra_strength += 1
-            run_attack_sim(weapon, character, 15, extra_mods, args.iterations)
-
-            print "Butcher lv3 frenzy 3:"
-            character.extra_speed += 1
-            character.extra_strength += 1
-            run_attack_sim(weapon, character, 15, extra_mods, args.iterations)
-
-            print "Butcher lv3 frenzy 4:"
-            character.extra_speed += 1
-            character.extra_strength += 1
-            run_attack_sim(weapon, character, 15, extra_mods, args.iterations)
-
-            print "Butcher lv3 frenzy 5:"
-            character.extra_speed += 1
-            character.extra_strength += 1
-            run_attack_sim(weapon, character, 15, extra_mods, args.iterations)
+            for frenzy in range(6):
+                if frenzy:
+                    print >> out, "Butcher lv3 frenzy {0}:".format(frenzy)
+                    character.extra_speed += 1
+                    character.extra_strength += 1
+                else:
+                    print >> out, "Butcher lv3 base:"
+                run(15)
         else:
-            run_attack_sim(weapon, character, 10, extra_mods, args.iterations)
-            #run_attack_sim(weapon, character, 11, extra_mods, args.iterations)
-            run_attack_sim(weapon, character, 12, extra_mods, args.iterations)
-            run_attack_sim(weapon, character, 14, extra_mods, args.iterations)
-            #run_attack_sim(weapon, character, 15, extra_mods, args.iterations)
+            run(10)
+            #run(11)
+            run(12)
+            run(14)
+            #run(15)
+        if writer:
+            writer.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,250 @@
+# benchmark.py
+#
+# Throughput benchmarks for the simulator hot paths and a statistical
+# equivalence check for the faster engines. Every workload runs from a
+# fixed seed so runs are comparable, and results can be saved as a JSON
+# baseline that later runs are checked against.
+#
+#   python benchmark.py --save baseline.json
+#   python benchmark.py --baseline baseline.json --threshold 0.1
+#   python benchmark.py --equivalence
+import argparse
+import json
+import sys
+import timeit
+
+import attack_exact
+import attack_sim
+import delving
+import dice
+import dice_exact
+import gathering
+import parallel
+import run_into_maw
+import stats
+
+
+# loadouts exercising most of the per-wound rules, the first is the one
+# timed by the attack workloads
+LOADOUTS = [
+    ("Bone Axe", "Xena", ["Axe Spec"]),
+    ("Bone Axe", "Kinzan", ["Axe Spec"]),
+    ("Beast Knuckles", "Boner", []),
+    ("Lantern Glaive", "Bo", ["Screaming Set"]),
+    ("Hollow Sword", "Xena", []),
+    ("Sonic Tomahawk", "Xena", ["Butcher lv3"]),
+]
+
+
+def prepare_plan(weapon_name, character_name, extra_mods):
+    weapon = attack_sim.load_weapon_data(weapon_name)
+    character = attack_sim.load_character_data(character_name)
+    attack_sim.apply_extra_mods(weapon, character, extra_mods)
+    return weapon, character, attack_sim.RulePlan(weapon, character, extra_mods)
+
+
+def attack_workload(iterations):
+    weapon, character, plan = prepare_plan(*LOADOUTS[0])
+    for _ in range(iterations):
+        plan.attack(12)
+
+
+def do_one_attack_workload(iterations):
+    # includes building the RulePlan on every attack, as the original loop did
+    weapon, character, plan = prepare_plan(*LOADOUTS[0])
+    for _ in range(iterations):
+        attack_sim.do_one_attack(weapon, character, 12, LOADOUTS[0][2])
+
+
+def attack_numpy_workload(iterations):
+    import attack_numpy
+    weapon, character, plan = prepare_plan(*LOADOUTS[0])
+    attack_numpy.run_attack_batch(plan, 12, iterations)
+
+
+def mine_workload(iterations):
+    for _ in range(iterations):
+        delving.mine(0, False, False, False, delving.MiningResults())
+
+
+def roll_value_workload(iterations):
+    for _ in range(iterations):
+        gathering.roll_value(dice.roll_n_dice(4))
+
+
+def roll_n_dice_workload(iterations):
+    for _ in range(iterations):
+        dice.roll_n_dice(6)
+
+
+WORKLOADS = [
+    ("attack", attack_workload),
+    ("do_one_attack", do_one_attack_workload),
+    ("attack_numpy", attack_numpy_workload),
+    ("mine", mine_workload),
+    ("roll_value", roll_value_workload),
+    ("roll_n_dice", roll_n_dice_workload),
+]
+
+
+def time_workload(func, iterations, repeat, seed):
+    # best of several runs, the minimum is the least disturbed by whatever
+    # else the machine is doing
+    best = None
+    for _ in range(repeat):
+        dice.seed(seed)
+        start = timeit.default_timer()
+        func(iterations)
+        elapsed = timeit.default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return {"iterations": iterations, "seconds": best, "rate": iterations / best,
+            "latency_us": best / iterations * 1e6}
+
+
+def run_benchmarks(names, iterations, repeat, seed):
+    results = {}
+    for name, func in WORKLOADS:
+        if name not in names:
+            continue
+        try:
+            results[name] = time_workload(func, iterations, repeat, seed)
+        except ImportError as error:
+            print >> sys.stderr, "WARNING: Skipping {0} ({1})".format(name, error)
+            continue
+        result = results[name]
+        print '{0:<16} {1:>12.0f} it/s {2:>10.2f} us/it'.format(name, result["rate"], result["latency_us"])
+    return results
+
+
+def check_regressions(results, baseline, threshold):
+    passed = True
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        change = results[name]["rate"] / baseline[name]["rate"] - 1.0
+        status = "ok"
+        if change < -threshold:
+            status = "REGRESSION"
+            passed = False
+        print '{0:<16} {1:>+8.1f}% vs baseline {2}'.format(name, change * 100.0, status)
+    return passed
+
+
+def sampled_histogram(weapon, character, extra_mods, engine, iterations, seed):
+    return parallel.run_sharded(attack_sim.attack_totals, (weapon, character, 12, extra_mods, engine),
+                                iterations, 1, seed)["distribution"]
+
+
+def mining_moments(max_depth, sickle, whip, almanac, iterations, seed):
+    # sums and sums of squares of each MiningResults field over seeded mine()
+    # runs, the same loop as delving.mining_totals
+    dice.seed(seed)
+    keys = vars(delving.MiningResults()).keys()
+    sums = dict((key, 0.0) for key in keys)
+    squares = dict((key, 0.0) for key in keys)
+    for _ in range(iterations):
+        cumulative_results = delving.MiningResults()
+        delving.mine(max_depth, sickle, whip, almanac, cumulative_results)
+        for key, value in vars(cumulative_results).items():
+            sums[key] += value
+            squares[key] += value * value
+    return sums, squares
+
+
+def delving_p_value(max_depth, sickle, whip, almanac, iterations, seed):
+    # every field's sampled mean against mine_exact, Bonferroni corrected
+    expected = vars(delving.mine_exact(max_depth, sickle, whip, almanac))
+    sums, squares = mining_moments(max_depth, sickle, whip, almanac, iterations, seed)
+    p_values = []
+    for key, total in sums.items():
+        mean = total / iterations
+        variance = max(squares[key] / iterations - mean * mean, 0.0) * iterations / (iterations - 1)
+        p_values.append(stats.mean_p_value(mean, expected[key], (variance / iterations) ** 0.5))
+    return min(1.0, min(p_values) * len(p_values))
+
+
+def equivalence_checks(iterations, seed):
+    # yields (description, p-value) for each engine against the reference
+    for weapon_name, character_name, extra_mods in LOADOUTS:
+        weapon, character, plan = prepare_plan(weapon_name, character_name, extra_mods)
+        label = '{0} / {1} {2}'.format(weapon_name, character_name, extra_mods)
+        reference = sampled_histogram(weapon, character, extra_mods, "python", iterations, seed)
+        # no cost limit, so the slow Combo Master walks are checked too
+        exact = attack_exact.evaluate(plan, 12, max_cost=None).distribution
+        yield label + ' python vs exact', stats.goodness_of_fit(reference.counts, exact.counts)
+        try:
+            vectorized = sampled_histogram(weapon, character, extra_mods, "numpy", iterations, seed)
+        except ImportError:
+            continue
+        yield label + ' numpy vs exact', stats.goodness_of_fit(vectorized.counts, exact.counts)
+        yield label + ' numpy vs python', stats.two_sample_test(vectorized.counts, reference.counts)
+
+    for num_dice in range(2, 7):
+        dice.seed(seed)
+        observed = [0] * (10 * num_dice + 1)
+        for _ in range(iterations):
+            observed[int(run_into_maw.roll_value(dice.roll_n_dice(num_dice)))] += 1
+        exact = dice_exact.distinct_sum_distribution(num_dice)
+        yield '{0} distinct dice vs exact'.format(num_dice), stats.goodness_of_fit(
+            observed, [exact.probability(value) for value in range(len(observed))])
+
+    # a quarter of the iterations per configuration, there are 32 of them
+    mining_iterations = max(iterations // 4, 1000)
+    for max_depth in range(4):
+        for sickle in (False, True):
+            for whip in (False, True):
+                for almanac in (False, True):
+                    label = 'delving depth {0} sickle={1:d} whip={2:d} almanac={3:d} vs exact'.format(
+                        max_depth, sickle, whip, almanac)
+                    yield label, delving_p_value(max_depth, sickle, whip, almanac, mining_iterations, seed)
+
+
+def run_equivalence(iterations, seed, alpha):
+    print 'Checking engine equivalence at {0} iterations (alpha {1})'.format(iterations, alpha)
+    passed = True
+    for label, p_value in equivalence_checks(iterations, seed):
+        status = "ok"
+        if p_value < alpha:
+            status = "MISMATCH"
+            passed = False
+        print '{0:<60} p = {1:.4f} {2}'.format(label, p_value, status)
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmark",
+                                     description='Benchmark the simulator hot paths and check engine equivalence',
+                                     add_help=True)
+    parser.add_argument('--iterations', type=int, help='The number of iterations per workload', default=100000)
+    parser.add_argument('--repeat', type=int, help='Runs per workload, the fastest is reported', default=3)
+    parser.add_argument('--seed', type=int, help='Seed shared by every workload', default=1)
+    parser.add_argument('--workloads', type=str, nargs='+', help='Workloads to run',
+                        choices=[name for name, func in WORKLOADS], default=[name for name, func in WORKLOADS])
+    parser.add_argument('--save', type=str, help='Write the results to this JSON baseline file', default=None)
+    parser.add_argument('--baseline', type=str, help='Compare the results with this JSON baseline file',
+                        default=None)
+    parser.add_argument('--threshold', type=float, help='Allowed fractional throughput drop against the baseline',
+                        default=0.1)
+    parser.add_argument('--equivalence', action='store_true',
+                        help='Also check the numpy and exact engines against the reference loop')
+    parser.add_argument('--alpha', type=float, help='Significance level for the equivalence tests', default=0.001)
+
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.workloads, args.iterations, args.repeat, args.seed)
+    passed = True
+    if args.baseline:
+        with open(args.baseline, "r") as read_file:
+            passed = check_regressions(results, json.load(read_file), args.threshold)
+    if args.save:
+        with open(args.save, "w") as write_file:
+            json.dump(results, write_file, indent=2, sort_keys=True)
+    if args.equivalence:
+        passed = run_equivalence(args.iterations, args.seed, args.alpha) and passed
+    return passed
+
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
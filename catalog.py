@@ -0,0 +1,118 @@
+# catalog.py
+#
+# Cached, indexed registry of weapon_data.json and characters.json. Both
+# files are parsed and validated once, looked up by name or by special mod
+# tag, and reloaded only when their modification time changes.
+import json
+import os
+import site
+import sys
+
+
+DATA_FILES = ("weapon_data.json", "characters.json")
+
+
+def find_data_dir():
+    # next to this module in a checkout or development install, otherwise
+    # where setup.py's data_files put them for a regular or --user install
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    for directory in (module_dir, os.path.join(sys.prefix, "share", "kdm-dice"),
+                      os.path.join(getattr(site, "USER_BASE", "") or "", "share", "kdm-dice")):
+        if all(os.path.exists(os.path.join(directory, name)) for name in DATA_FILES):
+            return directory
+    return module_dir
+
+
+DATA_DIR = find_data_dir()
+STATS = ("speed", "accuracy", "strength")
+
+
+def validate_entry(name, entry, tags_key, file_name):
+    if not isinstance(entry, dict):
+        raise RuntimeError('Invalid entry "{0}" in {1}: expected an object'.format(name, file_name))
+    for stat in STATS:
+        if stat not in entry:
+            raise RuntimeError('Invalid entry "{0}" in {1}: missing "{2}"'.format(name, file_name, stat))
+        if not isinstance(entry[stat], int) or isinstance(entry[stat], bool):
+            raise RuntimeError('Invalid entry "{0}" in {1}: "{2}" must be an integer'.format(name, file_name, stat))
+    tags = entry.get(tags_key, [])
+    if not isinstance(tags, list) or not all(isinstance(tag, basestring) for tag in tags):
+        raise RuntimeError('Invalid entry "{0}" in {1}: "{2}" must be a list of strings'.format(name, file_name,
+                                                                                             tags_key))
+
+
+class DataFile(object):
+    # One JSON file of named entries, indexed by name and by tag
+    def __init__(self, path, tags_key):
+        self.path = path
+        self.file_name = os.path.basename(path)
+        self.tags_key = tags_key
+        self.mtime = None
+        self.entries = {}
+        self.tags = {}
+
+    def refresh(self):
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.mtime:
+            return
+        with open(self.path, "r") as read_file:
+            data = json.load(read_file)
+        if not isinstance(data, dict):
+            raise RuntimeError('Invalid {0}: expected an object of named entries'.format(self.file_name))
+
+        tags = {}
+        for name, entry in data.items():
+            validate_entry(name, entry, self.tags_key, self.file_name)
+            for tag in entry.get(self.tags_key, []):
+                tags.setdefault(tag, []).append(name)
+        self.entries = data
+        self.tags = tags
+        self.mtime = mtime
+
+    def get(self, name, kind):
+        self.refresh()
+        if name not in self.entries:
+            raise RuntimeError('{0} not found in {1}: {2}'.format(kind, self.file_name, name))
+        return self.entries[name]
+
+    def names(self):
+        self.refresh()
+        return sorted(self.entries)
+
+    def tagged(self, tag):
+        self.refresh()
+        return sorted(self.tags.get(tag, []))
+
+
+class Catalog(object):
+    def __init__(self, data_dir=DATA_DIR):
+        self.weapons = DataFile(os.path.join(data_dir, "weapon_data.json"), "special mods")
+        self.characters = DataFile(os.path.join(data_dir, "characters.json"), "fighting arts")
+
+    def weapon_data(self, name):
+        return self.weapons.get(name, "Weapon")
+
+    def character_data(self, name):
+        return self.characters.get(name, "Character")
+
+    def weapon_names(self):
+        return self.weapons.names()
+
+    def character_names(self):
+        return self.characters.names()
+
+    def weapons_with_mod(self, mod):
+        return self.weapons.tagged(mod)
+
+    def characters_with_art(self, art):
+        return self.characters.tagged(art)
+
+
+_default_catalog = None
+
+
+def default_catalog():
+    global _default_catalog
+    if _default_catalog is None:
+        _default_catalog = Catalog()
+    return _default_catalog
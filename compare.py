@@ -0,0 +1,104 @@
+# compare.py
+#
+# Paired comparison of attack_sim loadouts using common random numbers.
+# Every configuration replays the same dice each iteration, so the noise
+# in the difference between two loadouts mostly cancels out.
+import argparse
+import random
+import sys
+
+import attack_sim
+import dice
+import stats
+
+
+class Loadout(object):
+    def __init__(self, spec):
+        # spec is "weapon[|character[|mod,mod]]"
+        parts = [part.strip() for part in spec.split("|")]
+        self.spec = spec
+        self.weapon = attack_sim.load_weapon_data(parts[0])
+        self.character = attack_sim.load_character_data(parts[1] if len(parts) > 1 and parts[1] else "Default")
+        self.extra_mods = []
+        if len(parts) > 2:
+            self.extra_mods = [mod.strip() for mod in parts[2].split(",") if mod.strip()]
+        self.warnings = attack_sim.apply_extra_mods(self.weapon, self.character, self.extra_mods)
+        self.plan = attack_sim.RulePlan(self.weapon, self.character, self.extra_mods)
+        self.wounds = stats.RunningStats()
+        self.difference = stats.RunningStats()
+
+    def attack(self, toughness, hit_stream, wound_stream):
+        # separate dice.ReplayStreams for the hit and wound phases keep the
+        # wound dice aligned between loadouts even when their speeds differ
+        hit_stream.rewind()
+        dice.use_stream(hit_stream)
+        hit_rolls, str, early_iron_failure = self.plan.roll_hit_dice()
+        if early_iron_failure:
+            return 0.0
+        wound_stream.rewind()
+        dice.use_stream(wound_stream)
+        hits, wounds = self.plan.resolve_wounds(hit_rolls, str, toughness)
+        if "Painted" in self.extra_mods:
+            wounds *= 2
+        return wounds
+
+
+def compare_loadouts(loadouts, toughness, iterations, seed=None):
+    master = random.Random(seed)
+    hit_stream = dice.ReplayStream(dice.DiceStream(master.getrandbits(64)))
+    wound_stream = dice.ReplayStream(dice.DiceStream(master.getrandbits(64)))
+    baseline = loadouts[0]
+    try:
+        for _ in range(iterations):
+            hit_stream.clear()
+            wound_stream.clear()
+            baseline_wounds = baseline.attack(toughness, hit_stream, wound_stream)
+            baseline.wounds.add(baseline_wounds)
+            for loadout in loadouts[1:]:
+                wounds = loadout.attack(toughness, hit_stream, wound_stream)
+                loadout.wounds.add(wounds)
+                loadout.difference.add(wounds - baseline_wounds)
+    finally:
+        dice.use_stream()
+
+
+def print_comparison(loadouts, toughness):
+    print 'T{0} - Baseline \"{1}\" expected wounds: {2:.3f} +/- {3:.3f}'.format(
+        toughness, loadouts[0].spec, loadouts[0].wounds.mean, 1.96 * loadouts[0].wounds.std_error)
+    for loadout in loadouts[1:]:
+        low, high = loadout.difference.confidence_interval()
+        if low > 0.0:
+            verdict = "better"
+        elif high < 0.0:
+            verdict = "worse"
+        else:
+            verdict = "not distinguishable"
+        print '\"{0}\" expected wounds: {1:.3f}, difference: {2:+.3f} (95% CI {3:+.3f} to {4:+.3f}), {5}'.format(
+            loadout.spec, loadout.wounds.mean, loadout.difference.mean, low, high, verdict)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="compare",
+                                     description='Compare KD:M loadouts with common random numbers',
+                                     add_help=True)
+    parser.add_argument('loadouts', type=str, nargs='+',
+                        help='Loadouts as \"weapon|character|mod,mod\", the first one is the baseline')
+    parser.add_argument('--toughness', type=int, help='The toughness of the monster', default=12)
+    parser.add_argument('--iterations', type=int, help='The number of iterations to run', default=20000)
+    parser.add_argument('--seed', type=int, help='Seed for reproducible runs', default=None)
+
+    args = parser.parse_args(argv)
+
+    loadouts = [Loadout(spec) for spec in args.loadouts]
+    for loadout in loadouts:
+        for warning in loadout.warnings:
+            print "WARNING: {0} ({1})".format(warning, loadout.spec)
+
+    compare_loadouts(loadouts, args.toughness, args.iterations, args.seed)
+    print_comparison(loadouts, args.toughness)
+    return True
+
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
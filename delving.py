@@ -3,10 +3,19 @@
 # Monte Carlo sims for calculating values and success rate
 # for mining and delving in KDM
 import argparse
-import copy
-import random
 import sys
 
+import adaptive
+import dice
+import parallel
+import rare_events
+import results
+
+
+# Bump whenever a rules change alters simulated results, so cached results
+# from older rules stop matching
+SIM_VERSION = 2
+
 
 class MiningResults(object):
     def __init__(self):
@@ -20,9 +29,32 @@ class MiningResults(object):
         self.gear = 0.0
         self.dead = 0.0
 
+    def print_info(self, margins=None):
+        # margins optionally holds a MiningResults of 95% interval half widths
+        for label, key, scale, format in PRINTED_RESULTS:
+            line = label.format(format.format(getattr(self, key) * scale))
+            if margins:
+                line += ' +/- {0}'.format(format.format(getattr(margins, key) * scale))
+            print line
+
+
+PRINTED_RESULTS = [
+    ('Avg depth: {0}', 'depth', 1.0, '{0:.2f}'),
+    ('Hemophobia disorder chance: {0}', 'hemo_disorder', 100.0, '{0}'),
+    ('Random disorder chance: {0}', 'random_disorder', 100.0, '{0}'),
+    ('Avg scraps: {0}', 'scrap', 1.0, '{0:.2f}'),
+    ('Avg iron: {0}', 'iron', 1.0, '{0:.2f}'),
+    ('Broken pickaxe chance: {0}', 'broken_pickaxe', 100.0, '{0}'),
+    ('Crystal skin chance: {0}', 'crystal_skin', 100.0, '{0}'),
+    ('Blacksmith gear chance: {0}', 'gear', 100.0, '{0}'),
+    ('Death chance: {0}', 'dead', 100.0, '{0}'),
+]
+# the yes/no outcomes --rare can estimate, scraps and iron are counts
+RARE_OUTCOMES = ['hemo_disorder', 'random_disorder', 'broken_pickaxe', 'crystal_skin', 'gear', 'dead']
+
 
 def mineral_gathering(go_deeper, cumulative_results):
-    roll = random.randint(1, 10)
+    roll = dice.d10()
     if roll <= 3:
         cumulative_results.hemo_disorder = 1.0
         return False
@@ -31,7 +63,7 @@ def mineral_gathering(go_deeper, cumulative_results):
         return False
     if roll <= 7:
         cumulative_results.iron += 1.0
-        if random.randint(1, 10) >= 6:
+        if dice.d10() >= 6:
             cumulative_results.broken_pickaxe = 1.0
         return False
     if roll >= 8:
@@ -40,7 +72,7 @@ def mineral_gathering(go_deeper, cumulative_results):
 
 
 def worm_tunnels(sickle, go_deeper, cumulative_results):
-    roll = random.randint(1, 10)
+    roll = dice.d10()
     if sickle:
         roll += 2
 
@@ -59,7 +91,7 @@ def worm_tunnels(sickle, go_deeper, cumulative_results):
 
 
 def crystal_lake(whip, go_deeper, cumulative_results):
-    roll = random.randint(1, 10)
+    roll = dice.d10()
     if whip:
         roll += 2
 
@@ -80,7 +112,7 @@ def crystal_lake(whip, go_deeper, cumulative_results):
 
 
 def lantern_city(almanac, cumulative_results):
-    roll = random.randint(1, 10)
+    roll = dice.d10()
     if almanac:
         roll += 2
 
@@ -103,69 +135,255 @@ def mine(max_depth, sickle, whip, almanac, cumulative_results):
                 lantern_city(almanac, cumulative_results)
 
 
-def mining_sim(iterations, max_depth, sickle, whip, almanac):
+def mining_totals(max_depth, sickle, whip, almanac, iterations):
+    totals = vars(MiningResults())
+    for _ in range(iterations):
+        cumulative_results = MiningResults()
+        mine(max_depth, sickle, whip, almanac, cumulative_results)
+        for key, value in vars(cumulative_results).items():
+            totals[key] += value
+    return totals
+
+
+def mining_config(max_depth, sickle, whip, almanac, seed):
+    return {
+        "sim": "delving",
+        "version": SIM_VERSION,
+        "max_depth": max_depth,
+        "sickle": sickle,
+        "whip": whip,
+        "almanac": almanac,
+        "seed": seed,
+    }
+
+
+def mining_record(max_depth, sickle, whip, almanac, method, iterations, averages):
+    # one row for results.ResultWriter
+    return [("sim", "delving"), ("max_depth", max_depth), ("sickle", sickle), ("whip", whip), ("almanac", almanac),
+            ("method", method), ("iterations", iterations)] + \
+        [(key, float(getattr(averages, key))) for label, key, scale, format in PRINTED_RESULTS]
+
+
+def mining_sim(iterations, max_depth, sickle, whip, almanac, workers=1, seed=None, cache=None, writer=None):
     print 'Calculating mining at {0} iterations'.format(iterations)
 
-    depth_count = 0.0
-    hemo_disorder_chance_count = 0.0
-    random_disorder_chance_count = 0.0
-    scrap_count = 0.0
-    iron_count = 0.0
-    broken_pickaxe_chance_count = 0.0
-    crystal_skin_chance_count = 0.0
-    gear_chance_count = 0.0
-    dead_chance_count = 0.0
-    for iteration in range(iterations):
+    args = (max_depth, sickle, whip, almanac)
+    if cache:
+        totals, iterations = cache.run(mining_config(max_depth, sickle, whip, almanac, seed), mining_totals, args,
+                                       iterations, workers, seed)
+    else:
+        totals = parallel.run_sharded(mining_totals, args, iterations, workers, seed)
+    averages = MiningResults()
+    for key, value in totals.items():
+        setattr(averages, key, value / iterations)
+    averages.print_info()
+    if writer:
+        writer.add(mining_record(max_depth, sickle, whip, almanac, "sampled", iterations, averages))
+
+
+def mining_sample(max_depth, sickle, whip, almanac):
+    cumulative_results = MiningResults()
+    mine(max_depth, sickle, whip, almanac, cumulative_results)
+    return [getattr(cumulative_results, key) for label, key, scale, format in PRINTED_RESULTS]
+
+
+def mining_adaptive(max_iterations, max_depth, sickle, whip, almanac, target_se, batch_size=5000, seed=None,
+                    writer=None):
+    print 'Calculating mining to a standard error of {0} in at most {1} iterations'.format(target_se,
+                                                                                        max_iterations)
+
+    keys = [key for label, key, scale, format in PRINTED_RESULTS]
+    results = adaptive.run_adaptive(lambda: mining_sample(max_depth, sickle, whip, almanac), keys, target_se,
+                                    max_iterations, batch_size, seed)
+    means = MiningResults()
+    margins = MiningResults()
+    for key, accumulator in results.items():
+        setattr(means, key, accumulator.mean)
+        setattr(margins, key, adaptive.margin(accumulator))
+    print 'Stopped after {0} iterations'.format(results["depth"].count)
+    means.print_info(margins)
+    if writer:
+        writer.add(mining_record(max_depth, sickle, whip, almanac, "adaptive", results["depth"].count, means))
+
+
+def mining_progressive(max_iterations, max_depth, sickle, whip, almanac, every, interval, seed, target_se=None):
+    keys = [key for label, key, scale, format in PRINTED_RESULTS]
+    snapshots = adaptive.progress_snapshots(lambda: mining_sample(max_depth, sickle, whip, almanac), keys,
+                                            max_iterations, every, interval, seed, target_se)
+    adaptive.print_progress(snapshots, sim="delving", max_depth=max_depth, sickle=sickle, whip=whip,
+                            almanac=almanac)
+
+
+def mining_rare(iterations, max_depth, sickle, whip, almanac, event, pilot, rounds, seed=None):
+    # importance sampled chance of one MiningResults outcome, e.g. gear.
+    # The score adds progress in depth so early pilot rounds learn to get
+    # deeper before the event itself is reachable.
+    def sample():
         cumulative_results = MiningResults()
         mine(max_depth, sickle, whip, almanac, cumulative_results)
+        return cumulative_results
+
+    def score(cumulative_results):
+        return cumulative_results.depth + (3.0 if getattr(cumulative_results, event) else 0.0)
+
+    print 'Estimating {0} chance by importance sampling at {1} iterations'.format(event, iterations)
+    accumulator, used_rounds = rare_events.estimate(sample, score, 3.0, iterations, pilot, rounds, seed)
+    rare_events.print_estimate('{0} chance'.format(event), accumulator, iterations, pilot, used_rounds)
 
-        hemo_disorder_chance_count += cumulative_results.hemo_disorder
-        random_disorder_chance_count += cumulative_results.random_disorder
-        broken_pickaxe_chance_count += cumulative_results.broken_pickaxe
-        crystal_skin_chance_count += cumulative_results.crystal_skin
-        gear_chance_count += cumulative_results.gear
-        dead_chance_count += cumulative_results.dead
-        if iteration == 0:
-            depth_count = cumulative_results.depth
-            scrap_count = cumulative_results.scrap
-            iron_count = cumulative_results.iron
-        elif iteration == 1:
-            # n_dice_avg[num_dice] = (table_total + n_dice_avg[num_dice]) / 2
-            depth_count = (cumulative_results.depth + depth_count) / 2
-            scrap_count = (cumulative_results.scrap + scrap_count) / 2
-            iron_count = (cumulative_results.iron + iron_count) / 2
-        elif iteration >= 2:
-            # Cumulative moving average
-            # n_dice_avg[num_dice] = (n_dice_avg[num_dice] * iteration + table_total) / (iteration + 1)
-            depth_count = (depth_count * iteration + cumulative_results.depth) / (iteration + 1)
-            scrap_count = (scrap_count * iteration + cumulative_results.scrap) / (iteration + 1)
-            iron_count = (iron_count * iteration + cumulative_results.iron) / (iteration + 1)
-
-    print 'Avg depth: {0:.2f}'.format(depth_count)
-    # print 'Disorder counts: {0}'.format(disorder_chance_count)
-    print 'Hemophobia disorder chance: {0}'.format(hemo_disorder_chance_count / iterations * 100.0)
-    print 'Random disorder chance: {0}'.format(random_disorder_chance_count / iterations * 100.0)
-    print 'Avg scraps: {0:.2f}'.format(scrap_count)
-    print 'Avg iron: {0:.2f}'.format(iron_count)
-    # print 'Broken pickaxe count: {0}'.format(broken_pickaxe_chance_count)
-    print 'Broken pickaxe chance: {0}'.format(broken_pickaxe_chance_count / iterations * 100.0)
-    # print 'Crystal skin count: {0}'.format(crystal_skin_chance_count)
-    print 'Crystal skin chance: {0}'.format(crystal_skin_chance_count / iterations * 100.0)
-    # print 'Blacksmith gear count: {0}'.format(gear_chance_count)
-    print 'Blacksmith gear chance: {0}'.format(gear_chance_count / iterations * 100.0)
-    # print 'Death count: {0}'.format(dead_chance_count)
-    print 'Death chance: {0}'.format(dead_chance_count / iterations * 100.0)
-
-
-def main():
+
+# Exact evaluation
+#
+# Each stage below mirrors its sampling counterpart above, but instead of
+# rolling a die it walks all ten faces, adds each outcome weighted by the
+# chance of reaching the stage and returns the chance of going deeper.
+def mineral_gathering_exact(go_deeper, chance, expected_results):
+    deeper = 0.0
+    for roll in range(1, 11):
+        weight = chance / 10.0
+        if roll <= 3:
+            expected_results.hemo_disorder += weight
+        elif roll <= 5:
+            expected_results.scrap += weight
+        elif roll <= 7:
+            expected_results.iron += weight
+            # broken on a 6+ follow up roll
+            expected_results.broken_pickaxe += weight * 0.5
+        else:
+            expected_results.scrap += weight
+            if go_deeper:
+                deeper += weight
+    return deeper
+
+
+def worm_tunnels_exact(sickle, go_deeper, chance, expected_results):
+    deeper = 0.0
+    for roll in range(1, 11):
+        weight = chance / 10.0
+        if sickle:
+            roll += 2
+
+        if roll <= 3:
+            expected_results.random_disorder += weight
+        elif roll <= 7:
+            continue
+        elif go_deeper:
+            deeper += weight
+        else:
+            expected_results.iron += weight
+    return deeper
+
+
+def crystal_lake_exact(whip, go_deeper, chance, expected_results):
+    deeper = 0.0
+    for roll in range(1, 11):
+        weight = chance / 10.0
+        if whip:
+            roll += 2
+
+        if roll <= 2:
+            expected_results.crystal_skin += weight
+        elif roll <= 4:
+            expected_results.random_disorder += weight
+        elif roll <= 6:
+            continue
+        elif go_deeper:
+            deeper += weight
+        else:
+            expected_results.iron += 2.0 * weight
+    return deeper
+
+
+def lantern_city_exact(almanac, chance, expected_results):
+    for roll in range(1, 11):
+        weight = chance / 10.0
+        if almanac:
+            roll += 2
+
+        if roll <= 4:
+            expected_results.dead += weight
+        elif roll <= 9:
+            expected_results.iron += 4.0 * weight
+            expected_results.scrap += 3.0 * weight
+        else:
+            expected_results.gear += weight
+
+
+def mine_exact(max_depth, sickle, whip, almanac):
+    expected_results = MiningResults()
+    chance = mineral_gathering_exact(max_depth >= 1 or max_depth == 0, 1.0, expected_results)
+    expected_results.depth += chance
+    chance = worm_tunnels_exact(sickle, max_depth >= 2 or max_depth == 0, chance, expected_results)
+    expected_results.depth += chance
+    chance = crystal_lake_exact(whip, max_depth >= 3 or max_depth == 0, chance, expected_results)
+    lantern_city_exact(almanac, chance, expected_results)
+    return expected_results
+
+
+def mining_exact(max_depth, sickle, whip, almanac, writer=None):
+    print 'Calculating exact mining results'
+    expected_results = mine_exact(max_depth, sickle, whip, almanac)
+    expected_results.print_info()
+    if writer:
+        writer.add(mining_record(max_depth, sickle, whip, almanac, "exact", 0, expected_results))
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(prog="gathering",
                                      description='Calculate values and success chance for herb gathering in KD:M',
                                      add_help=True)
 
     parser.add_argument('--iterations', type=int, help='The number of iterations to run', default=1000000)
     parser.add_argument('--max_depth', type=int, help='Max depth to delve.', default=0)
+    parser.add_argument('--exact', action='store_true', help='Compute exact results instead of sampling')
+    parser.add_argument('--workers', type=int, help='The number of worker processes to shard iterations across',
+                        default=1)
+    parser.add_argument('--seed', type=int, help='Seed for reproducible runs', default=None)
+    parser.add_argument('--all', action='store_true',
+                        help='Evaluate every sickle/whip/almanac combination at --max_depth')
+    adaptive.add_adaptive_arguments(parser)
+    parser.add_argument('--cache_dir', type=str, help='Reuse and extend results cached in this directory',
+                        default=None)
+    parser.add_argument('--cache_size', type=int, help='The maximum number of cached results to keep',
+                        default=1000)
+    parser.add_argument('--rare', type=str, choices=RARE_OUTCOMES, default=None,
+                        help='Estimate the chance of this rare outcome, e.g. gear or dead, by importance sampling')
+    rare_events.add_rare_arguments(parser)
+    results.add_output_arguments(parser)
+
+    args = parser.parse_args(argv)
+    cache = None
+    if args.cache_dir:
+        import result_cache
+        cache = result_cache.ResultCache(args.cache_dir, args.cache_size)
+    writer = results.open_writer(args)
+    # progress runs keep stdout to the JSON lines
+    out = sys.stderr if adaptive.progress_requested(args) else sys.stdout
+
+    def run_sim(max_depth, sickle, whip, almanac):
+        if args.rare:
+            mining_rare(args.iterations, max_depth, sickle, whip, almanac, args.rare, args.rare_pilot,
+                        args.rare_rounds, args.seed)
+        elif args.exact:
+            mining_exact(max_depth, sickle, whip, almanac, writer)
+        elif adaptive.progress_requested(args):
+            mining_progressive(args.iterations, max_depth, sickle, whip, almanac, args.batch_size,
+                               args.progress_seconds, args.seed, adaptive.target_std_error(args))
+        elif adaptive.target_std_error(args):
+            mining_adaptive(args.iterations, max_depth, sickle, whip, almanac, adaptive.target_std_error(args),
+                            args.batch_size, args.seed, writer)
+        else:
+            mining_sim(args.iterations, max_depth, sickle, whip, almanac, args.workers, args.seed, cache, writer)
+
+    if args.all:
+        for sickle in (False, True):
+            for whip in (False, True):
+                for almanac in (False, True):
+                    print >> out, '\nSim with sickle={0}, whip={1}, almanac={2}'.format(sickle, whip, almanac)
+                    run_sim(args.max_depth, sickle, whip, almanac)
+        if writer:
+            writer.close()
+        return
 
-    args = parser.parse_args()
     # print '\nSim with sickle + whip + almanac'
     # mining_sim(args.iterations, args.max_depth, True, True, True)
     # print '\nSim with sickle + whip'
@@ -176,10 +394,12 @@ def main():
     # mining_sim(args.iterations, args.max_depth, False, True, False)
     # print '\nSim with nothing'
     # mining_sim(args.iterations, args.max_depth, False, False, False)
-    print '\nSim with Sickle and Whip, stopping at Crystal Lake'
-    mining_sim(args.iterations, 2, True, True, False)
-    print '\nSim with Sickle, stopping at Crystal Lake'
-    mining_sim(args.iterations, 2, True, False, False)
+    print >> out, '\nSim with Sickle and Whip, stopping at Crystal Lake'
+    run_sim(2, True, True, False)
+    print >> out, '\nSim with Sickle, stopping at Crystal Lake'
+    run_sim(2, True, False, False)
+    if writer:
+        writer.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,179 @@
+# delving_policy.py
+#
+# Finds the best delving policy for a utility over the mining results.
+# After each successful stage a delver either stops and takes that stage's
+# reward or goes deeper, so the best choice at every stage is found by
+# backward induction from Lantern City. Each stage outcome only depends
+# on that stage's own piece of equipment, so every (stage, equipment,
+# choice) is evaluated once and shared by all equipment combinations.
+#
+# Example:
+#   python delving_policy.py --utility "iron=1,scrap=0.5,gear=10,dead=-20" --all
+import argparse
+import random
+import sys
+
+import delving
+import dice
+
+
+# (name, equipment flag, exact evaluator, sampled stage)
+STAGES = [
+    ("Mineral Gathering", None, delving.mineral_gathering_exact, delving.mineral_gathering),
+    ("Worm Tunnels", "sickle", delving.worm_tunnels_exact, delving.worm_tunnels),
+    ("Crystal Lake", "whip", delving.crystal_lake_exact, delving.crystal_lake),
+]
+FINAL_STAGE = ("Lantern City", "almanac", delving.lantern_city_exact, delving.lantern_city)
+
+EQUIPMENT = ["sickle", "whip", "almanac"]
+
+
+def parse_utility(spec):
+    # "iron=1,scrap=0.5,dead=-20" into weights by MiningResults field
+    fields = vars(delving.MiningResults())
+    utility = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        key, _, weight = part.partition("=")
+        key = key.strip()
+        if key not in fields:
+            raise RuntimeError('Unknown utility key: {0}, expected one of: {1}'.format(key,
+                                                                                    ', '.join(sorted(fields))))
+        utility[key] = float(weight)
+    return utility
+
+
+def utility_of(results, utility):
+    return sum(weight * getattr(results, key) for key, weight in utility.items())
+
+
+def add_results(results, other, weight=1.0):
+    for key, value in vars(other).items():
+        setattr(results, key, getattr(results, key) + value * weight)
+    return results
+
+
+class StageEvaluator(object):
+    # expected results of a single stage entered with certainty, and the
+    # chance of going deeper, exact by default or from a shared sample
+    def __init__(self, iterations=None, seed=None):
+        self.iterations = iterations
+        if seed is None:
+            # stages must share dice even in unseeded runs
+            seed = random.SystemRandom().getrandbits(64)
+        self.seed = seed
+        self.outcomes = {}
+
+    def evaluate(self, stage, equipped, go_deeper, final=False):
+        key = (stage[0], equipped, go_deeper)
+        if key not in self.outcomes:
+            args = ((equipped,) if stage[1] else ()) + (() if final else (go_deeper,))
+            if self.iterations:
+                self.outcomes[key] = self.sample(stage[3], args)
+            else:
+                results = delving.MiningResults()
+                deeper = stage[2](*(args + (1.0, results)))
+                self.outcomes[key] = (results, deeper or 0.0)
+        return self.outcomes[key]
+
+    def sample(self, stage_func, args):
+        # every variant replays the same dice, so differences between
+        # choices aren't swamped by sampling noise
+        dice.seed(self.seed)
+        totals = delving.MiningResults()
+        deeper = 0
+        for _ in range(self.iterations):
+            results = delving.MiningResults()
+            if stage_func(*(args + (results,))):
+                deeper += 1
+            add_results(totals, results)
+        average = add_results(delving.MiningResults(), totals, 1.0 / self.iterations)
+        return average, float(deeper) / self.iterations
+
+
+def optimize(equipment, utility, evaluator):
+    # returns the go deeper choice at each stage and the expected results
+    equipped = dict((item, item in equipment) for item in EQUIPMENT)
+    expected, _ = evaluator.evaluate(FINAL_STAGE, equipped[FINAL_STAGE[1]], True, final=True)
+    policy = []
+    for index in reversed(range(len(STAGES))):
+        stage = STAGES[index]
+        stage_equipped = equipped.get(stage[1], False)
+        stop, _ = evaluator.evaluate(stage, stage_equipped, False)
+        go, deeper = evaluator.evaluate(stage, stage_equipped, True)
+        go = add_results(add_results(delving.MiningResults(), go), expected, deeper)
+        # depth counts Worm Tunnels and Crystal Lake reached, as in mine
+        if index < len(STAGES) - 1:
+            go.depth += deeper
+        if utility_of(go, utility) > utility_of(stop, utility):
+            policy.insert(0, True)
+            expected = go
+        else:
+            policy.insert(0, False)
+            expected = add_results(delving.MiningResults(), stop)
+    return policy, expected
+
+
+def policy_max_depth(policy):
+    # the equivalent delving --max_depth, None if it can't be expressed
+    if all(policy):
+        return 0
+    stop = policy.index(False)
+    return stop if stop else None
+
+
+def describe_policy(policy):
+    choices = []
+    for (name, item, exact, sampled), go_deeper in zip(STAGES, policy):
+        choices.append('{0}: {1}'.format(name, "go" if go_deeper else "stop"))
+        if not go_deeper:
+            break
+    return ', '.join(choices)
+
+
+def equipment_sets(args):
+    if args.all:
+        sets = [[]]
+        for item in EQUIPMENT:
+            sets = [equipment + extra for equipment in sets for extra in ([], [item])]
+        return sets
+    return [[item for item in EQUIPMENT if getattr(args, item)]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="delving_policy",
+                                     description='Find the best delving policy for a utility in KD:M',
+                                     add_help=True)
+    parser.add_argument('--utility', type=str, help='Weights of mining results, e.g. \"iron=1,scrap=0.5,dead=-20\"',
+                        default='iron=1,scrap=0.5,gear=5,dead=-20')
+    parser.add_argument('--sickle', action='store_true', help='Delve with a sickle')
+    parser.add_argument('--whip', action='store_true', help='Delve with a whip')
+    parser.add_argument('--almanac', action='store_true', help='Delve with an almanac')
+    parser.add_argument('--all', action='store_true', help='Rank every sickle/whip/almanac combination')
+    parser.add_argument('--iterations', type=int, default=None,
+                        help='Estimate each stage from this many shared samples instead of exactly')
+    parser.add_argument('--seed', type=int, help='Seed for reproducible runs', default=None)
+
+    args = parser.parse_args(argv)
+
+    utility = parse_utility(args.utility)
+    evaluator = StageEvaluator(args.iterations, args.seed)
+    ranked = []
+    for equipment in equipment_sets(args):
+        policy, expected = optimize(equipment, utility, evaluator)
+        ranked.append((utility_of(expected, utility), equipment, policy, expected))
+    ranked.sort(key=lambda entry: -entry[0])
+
+    for value, equipment, policy, expected in ranked:
+        max_depth = policy_max_depth(policy)
+        print '\n[{0}] utility {1:.3f}'.format(', '.join(equipment) or "no equipment", value)
+        print 'Policy: {0}{1}'.format(describe_policy(policy),
+                                      '' if max_depth is None else ' (--max_depth {0})'.format(max_depth))
+        expected.print_info()
+    return True
+
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
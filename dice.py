@@ -0,0 +1,186 @@
+# dice.py
+#
+# Shared d10 source for the simulators. A DiceStream owns its own
+# random.Random and hands out dice from a buffer that is refilled a chunk
+# at a time, so the hot loops take dice from a list instead of calling
+# into random for every die. Streams are seeded explicitly and can spawn
+# independent child streams for parallel workers.
+#
+# The module level d10(), roll_n_dice() and seed() use a default stream
+# shared by everything in the process. use_stream() routes them through
+# another stream instead, e.g. a TiltedStream for importance sampling or a
+# ReplayStream to hand several loadouts the same dice.
+import binascii
+import bisect
+import random
+
+
+# random bytes generated per refill
+CHUNK_SIZE = 4096
+
+# each random byte maps to a face by its value mod 10, bytes 250-255 are
+# dropped so every face stays equally likely
+FACES = ''.join(chr(byte % 10 + 1) for byte in range(256))
+REJECTED = ''.join(chr(byte) for byte in range(250, 256))
+
+
+class DiceStream(object):
+    def __init__(self, seed=None, chunk_size=CHUNK_SIZE):
+        self.seed(seed, chunk_size)
+
+    def seed(self, seed=None, chunk_size=CHUNK_SIZE):
+        # None seeds from the operating system
+        self.random = random.Random(seed)
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.position = 0
+
+    def refill(self):
+        bits = self.random.getrandbits(self.chunk_size * 8)
+        data = binascii.unhexlify('{0:0{1}x}'.format(bits, self.chunk_size * 2))
+        # dice left over from a short roll() are carried into the new buffer
+        self.buffer = self.buffer[self.position:] + list(bytearray(data.translate(FACES, REJECTED)))
+        self.position = 0
+
+    def d10(self):
+        position = self.position
+        if position >= len(self.buffer):
+            self.refill()
+            position = 0
+        self.position = position + 1
+        return self.buffer[position]
+
+    def roll(self, n):
+        position = self.position
+        while position + n > len(self.buffer):
+            self.refill()
+            position = 0
+        self.position = position + n
+        return self.buffer[position:position + n]
+
+    def getrandbits(self, k):
+        return self.random.getrandbits(k)
+
+    def uniform(self):
+        # a float in [0, 1), e.g. to settle an outcome from a chance table
+        return self.random.random()
+
+    def spawn(self, count):
+        # independent child streams, e.g. one per worker process
+        return [DiceStream(self.random.getrandbits(64)) for _ in range(count)]
+
+
+class TiltedStream(object):
+    # Biased dice for importance sampling. Die number i of a sample is
+    # drawn from tilts[i], ten face chances (fair past the end of the
+    # list), and weight is the likelihood ratio of the dice drawn so far
+    # under fair dice to the tilted ones. Call start() before each sample.
+    def __init__(self, tilts, seed=None):
+        self.random = random.Random(seed)
+        self.tilts = tilts
+        self.cumulative = []
+        self.ratios = []
+        for tilt in tilts:
+            running = []
+            total = 0.0
+            for chance in tilt:
+                total += chance
+                running.append(total)
+            self.cumulative.append(running)
+            self.ratios.append([0.1 / chance if chance else float("inf") for chance in tilt])
+        self.start()
+
+    def start(self):
+        self.weight = 1.0
+        self.faces = []
+
+    def d10(self):
+        position = len(self.faces)
+        if position < len(self.cumulative):
+            cumulative = self.cumulative[position]
+            face = min(bisect.bisect_right(cumulative, self.random.random() * cumulative[-1]), 9) + 1
+            self.weight *= self.ratios[position][face - 1]
+        else:
+            face = int(self.random.random() * 10) + 1
+        self.faces.append(face)
+        return face
+
+    def roll(self, n):
+        return [self.d10() for _ in range(n)]
+
+    def getrandbits(self, k):
+        return self.random.getrandbits(k)
+
+    def uniform(self):
+        # not tilted, so it leaves the weight alone
+        return self.random.random()
+
+
+class ReplayStream(object):
+    # Hands out the same dice again after rewind(). Dice and uniforms are
+    # drawn from source the first time each position is reached and kept
+    # until clear(), so consumers that need different numbers of dice
+    # still share every die they both roll.
+    def __init__(self, source):
+        self.source = source
+        self.faces = []
+        self.uniforms = []
+        self.rewind()
+
+    def rewind(self):
+        self.position = 0
+        self.uniform_position = 0
+
+    def clear(self):
+        del self.faces[:]
+        del self.uniforms[:]
+        self.rewind()
+
+    def d10(self):
+        position = self.position
+        if position >= len(self.faces):
+            self.faces.append(self.source.d10())
+        self.position = position + 1
+        return self.faces[position]
+
+    def roll(self, n):
+        position = self.position
+        end = position + n
+        if end > len(self.faces):
+            self.faces.extend(self.source.roll(end - len(self.faces)))
+        self.position = end
+        return self.faces[position:end]
+
+    def getrandbits(self, k):
+        return self.source.getrandbits(k)
+
+    def uniform(self):
+        position = self.uniform_position
+        if position >= len(self.uniforms):
+            self.uniforms.append(self.source.uniform())
+        self.uniform_position = position + 1
+        return self.uniforms[position]
+
+
+default_stream = DiceStream()
+
+d10 = default_stream.d10
+roll_n_dice = default_stream.roll
+getrandbits = default_stream.getrandbits
+uniform = default_stream.uniform
+
+
+def use_stream(stream=None):
+    # routes d10(), roll_n_dice(), getrandbits() and uniform() through
+    # stream, or back to the default stream. seed() always seeds the
+    # default stream.
+    global d10, roll_n_dice, getrandbits, uniform
+    stream = stream or default_stream
+    d10 = stream.d10
+    roll_n_dice = stream.roll
+    getrandbits = stream.getrandbits
+    uniform = stream.uniform
+
+
+def seed(seed=None, chunk_size=CHUNK_SIZE):
+    default_stream.seed(seed, chunk_size)
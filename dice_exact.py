@@ -0,0 +1,159 @@
+# dice_exact.py
+#
+# Exact distributions for rolls of distinct-valued dice, as used by
+# gathering and running into the maw in KDM. A roll is only worth its
+# sum when every die shows a different value, otherwise it is worth 0.
+#
+# Table totals for any number of players come from convolving the single
+# player distribution with itself by repeated squaring.
+import bisect
+import operator
+
+import table_cache
+
+
+# table totals less likely than this are dropped while convolving
+CUTOFF = 1e-15
+
+
+class SumDistribution(object):
+    def __init__(self, num_dice, sides, counts):
+        self.num_dice = num_dice
+        self.sides = sides
+        self.outcomes = sides ** num_dice
+        self.counts = counts
+
+    def probability(self, value):
+        return float(self.counts.get(value, 0)) / self.outcomes
+
+    @property
+    def mean(self):
+        return float(sum(value * count for value, count in self.counts.items())) / self.outcomes
+
+    @property
+    def fail_chance(self):
+        return self.probability(0)
+
+    def print_info(self):
+        for value in sorted(self.counts):
+            print '  {0:>3}: {1:.4f}%'.format(value, self.probability(value) * 100.0)
+
+
+def distinct_subset_sums(num_dice, sides):
+    # ways[k][s] is the number of k-element subsets of 1..sides summing to s
+    max_sum = sides * num_dice
+    ways = [[0] * (max_sum + 1) for _ in range(num_dice + 1)]
+    ways[0][0] = 1
+    for face in range(1, sides + 1):
+        for k in range(min(face, num_dice), 0, -1):
+            for s in range(max_sum, face - 1, -1):
+                ways[k][s] += ways[k - 1][s - face]
+    return ways[num_dice]
+
+
+def distinct_sum_distribution(num_dice, sides=10):
+    counts = {}
+    if num_dice <= sides:
+        orderings = 1
+        for k in range(2, num_dice + 1):
+            orderings *= k
+        for total, subsets in enumerate(distinct_subset_sums(num_dice, sides)):
+            if subsets:
+                counts[total] = subsets * orderings
+    valid = sum(counts.values())
+    failures = sides ** num_dice - valid
+    if failures:
+        counts[0] = counts.get(0, 0) + failures
+    return SumDistribution(num_dice, sides, counts)
+
+
+class TableDistribution(object):
+    # Probabilities of every table total from low upwards, summed over the
+    # players. The cumulative chances are built once so queries don't
+    # rescan the table.
+    def __init__(self, players, low, chances):
+        self.players = players
+        self.low = low
+        self.chances = chances
+        self.cumulative = []
+        total = 0.0
+        for chance in chances:
+            total += chance
+            self.cumulative.append(total)
+
+    @property
+    def mean(self):
+        return sum((self.low + index) * chance for index, chance in enumerate(self.chances))
+
+    def percentile(self, fraction):
+        index = bisect.bisect_left(self.cumulative, fraction * self.cumulative[-1])
+        return self.low + min(index, len(self.chances) - 1)
+
+    def at_least(self, threshold):
+        index = threshold - self.low
+        if index <= 0:
+            return self.cumulative[-1]
+        if index >= len(self.chances):
+            return 0.0
+        return self.cumulative[-1] - self.cumulative[index - 1]
+
+
+def convolve(table, other, cutoff=CUTOFF):
+    # distribution of the sum of two independent totals, each given as
+    # (lowest value, chances from there up). Values at either end too
+    # unlikely to matter are dropped so the support stays near the centre.
+    low, chances = table
+    other_low, other_chances = other
+    try:
+        # numpy is optional, the pure python loop below is much slower
+        import numpy
+        combined = numpy.convolve(chances, other_chances).tolist()
+    except ImportError:
+        combined = [0.0] * (len(chances) + len(other_chances) - 1)
+        width = len(chances)
+        for shift, other_chance in enumerate(other_chances):
+            if other_chance:
+                combined[shift:shift + width] = map(operator.add, combined[shift:shift + width],
+                                                    [chance * other_chance for chance in chances])
+    start = 0
+    while start < len(combined) - 1 and combined[start] < cutoff:
+        start += 1
+    end = len(combined)
+    while end > start + 1 and combined[end - 1] < cutoff:
+        end -= 1
+    return low + other_low + start, combined[start:end]
+
+
+# table distributions kept for repeated queries, least recently used first
+# out once there are more
+MAX_TABLES = 256
+_tables = table_cache.TableCache(MAX_TABLES)
+
+
+def player_chances(num_dice, sides=10):
+    single = distinct_sum_distribution(num_dice, sides)
+    return 0, [single.probability(value) for value in range(max(single.counts) + 1)]
+
+
+def convolve_power(player, players):
+    # the total of players independent players by repeated squaring, so a
+    # table takes O(log players) convolutions
+    table = (0, [1.0])
+    while players:
+        if players & 1:
+            table = convolve(table, player)
+        players >>= 1
+        if players:
+            player = convolve(player, player)
+    return table
+
+
+def build_table_distribution(num_dice, players, sides):
+    low, chances = convolve_power(player_chances(num_dice, sides), players)
+    return TableDistribution(players, low, chances)
+
+
+def table_distribution(num_dice, players, sides=10):
+    # only the requested tables are cached, so the cache stays bounded
+    return _tables.get(("table", num_dice, players, sides),
+                       lambda: build_table_distribution(num_dice, players, sides))
@@ -0,0 +1,176 @@
+# fight.py
+#
+# Whole fight simulation built on attack_sim. A fight is one attack per
+# round against a monster with a pool of wounds, until the pool is gone or
+# the round limit is reached. Frenzy stacks add speed and strength every
+# round and Beast Knuckles toughness reductions carry over between
+# attacks. The result is the distribution of rounds needed to kill.
+#
+# Per fight state is only the wounds dealt and the current toughness, kept
+# in flat lists (arrays for the numpy engine). Every round advances all
+# fights still running with one RulePlan compiled up front per frenzy
+# level, so nothing is copied per fight.
+import argparse
+import collections
+import copy
+import sys
+
+import attack_sim
+import dice
+import parallel
+
+
+CHUNK_SIZE = 65536
+
+
+def frenzy_plans(weapon, character, extra_mods, max_frenzy):
+    # one plan per frenzy level, each stack is +1 speed and +1 strength
+    plans = []
+    for frenzy in range(max_frenzy + 1):
+        frenzied = copy.deepcopy(character)
+        frenzied.extra_speed += frenzy
+        frenzied.extra_strength += frenzy
+        plans.append(attack_sim.RulePlan(weapon, frenzied, extra_mods))
+    return plans
+
+
+def round_frenzy(round_number, start_frenzy, frenzy_per_round, max_frenzy):
+    return min(start_frenzy + round_number * frenzy_per_round, max_frenzy)
+
+
+def run_fights(plans, fights, toughness, wound_pool, frenzy, max_rounds, carry_toughness, scale):
+    # rounds to kill for every fight, max_rounds + 1 for fights still running
+    turns = collections.defaultdict(int)
+    wounds = [0.0] * fights
+    toughnesses = [toughness] * fights
+    active = range(fights)
+    for round_number in range(max_rounds):
+        plan = plans[frenzy(round_number)]
+        running = []
+        for fight in active:
+            hit_rolls, str, early_iron_failure = plan.roll_hit_dice()
+            if not early_iron_failure:
+                state = attack_sim.AttackState(plan, toughnesses[fight])
+                hits, dealt = plan.resolve_wounds(hit_rolls, str, None, state)
+                wounds[fight] += dealt * scale
+                if carry_toughness:
+                    toughnesses[fight] = state.toughness
+            if wounds[fight] >= wound_pool:
+                turns[round_number + 1] += 1
+            else:
+                running.append(fight)
+        active = running
+        if not active:
+            break
+    turns[max_rounds + 1] += len(active)
+    return turns
+
+
+def run_fights_numpy(plans, fights, toughness, wound_pool, frenzy, max_rounds, carry_toughness, scale, rng):
+    import numpy
+    import attack_numpy
+    turns = collections.defaultdict(int)
+    wounds = numpy.zeros(fights, dtype=int)
+    toughnesses = numpy.full(fights, toughness, dtype=int)
+    active = numpy.arange(fights)
+    for round_number in range(max_rounds):
+        hits, dealt, early_iron, final_toughness = attack_numpy.do_attack_batch(
+            plans[frenzy(round_number)], toughnesses[active], len(active), rng)
+        wounds[active] += dealt * scale
+        if carry_toughness:
+            toughnesses[active] = final_toughness
+        killed = wounds[active] >= wound_pool
+        turns[round_number + 1] += int(killed.sum())
+        active = active[~killed]
+        if not len(active):
+            break
+    turns[max_rounds + 1] += len(active)
+    return turns
+
+
+def fight_totals(weapon, character, extra_mods, toughness, wound_pool, start_frenzy, frenzy_per_round, max_frenzy,
+                 max_rounds, carry_toughness, engine, iterations):
+    max_frenzy = max(max_frenzy, start_frenzy)
+    plans = frenzy_plans(weapon, character, extra_mods, max_frenzy)
+    frenzy = lambda round_number: round_frenzy(round_number, start_frenzy, frenzy_per_round, max_frenzy)
+    scale = 2 if "Painted" in extra_mods else 1
+    rng = None
+    if engine == "numpy":
+        import numpy
+        rng = numpy.random.RandomState(dice.getrandbits(32))
+
+    totals = {"turns": {}}
+    remaining = iterations
+    while remaining > 0:
+        fights = min(remaining, CHUNK_SIZE)
+        if rng is not None:
+            turns = run_fights_numpy(plans, fights, toughness, wound_pool, frenzy, max_rounds, carry_toughness,
+                                     scale, rng)
+        else:
+            turns = run_fights(plans, fights, toughness, wound_pool, frenzy, max_rounds, carry_toughness, scale)
+        parallel.merge_totals(totals, {"turns": turns})
+        remaining -= fights
+    return totals
+
+
+def print_turns(turns, iterations, max_rounds):
+    killed = 0.0
+    total_turns = 0.0
+    for round_number in range(1, max_rounds + 1):
+        count = turns.get(round_number, 0.0)
+        killed += count
+        total_turns += count * round_number
+        if count:
+            print '  Round {0:>2}: {1:6.2f}%, killed by now {2:6.2f}%'.format(round_number, count / iterations * 100.0,
+                                                                            killed / iterations * 100.0)
+    if killed:
+        print 'Average rounds to kill: {0:.2f}'.format(total_turns / killed)
+    print 'Not killed within {0} rounds: {1:.2f}%'.format(max_rounds,
+                                                         turns.get(max_rounds + 1, 0.0) / iterations * 100.0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="fight", description='Simulate whole KD:M fights round by round',
+                                     add_help=True)
+    parser.add_argument('weapon', type=str, help='The name of the weapon to fight with')
+    parser.add_argument('--character', type=str, help='The name of the character to use', default="Default")
+    parser.add_argument('--extra_mods', type=str, help='CSV list of extra mods. e.g. \"Axe Spec, Butcher lv3\"',
+                        default='')
+    parser.add_argument('--toughness', type=int, help='The toughness of the monster', default=12)
+    parser.add_argument('--wounds', type=int, help='The wounds needed to kill the monster', default=10)
+    parser.add_argument('--start_frenzy', type=int, help='Frenzy stacks at the start of the fight', default=0)
+    parser.add_argument('--frenzy_per_round', type=int, help='Frenzy stacks gained every round', default=0)
+    parser.add_argument('--max_frenzy', type=int, help='The most frenzy stacks that can be held', default=5)
+    parser.add_argument('--max_rounds', type=int, help='Give up on a fight after this many rounds', default=20)
+    parser.add_argument('--reset_toughness', action='store_true',
+                        help='Restore toughness after every attack instead of carrying Beast Knuckles over')
+    parser.add_argument('--iterations', type=int, help='The number of fights to run', default=100000)
+    parser.add_argument('--engine', type=str, help='Simulation engine to use', choices=['python', 'numpy'],
+                        default='python')
+    parser.add_argument('--workers', type=int, help='The number of worker processes to shard fights across',
+                        default=1)
+    parser.add_argument('--seed', type=int, help='Seed for reproducible runs', default=None)
+
+    args = parser.parse_args(argv)
+
+    weapon = attack_sim.load_weapon_data(args.weapon)
+    character = attack_sim.load_character_data(args.character)
+    extra_mods = [mod.strip() for mod in args.extra_mods.split(',') if mod.strip()]
+    for warning in attack_sim.apply_extra_mods(weapon, character, extra_mods):
+        print "WARNING: {0}".format(warning)
+    character.print_info()
+    weapon.print_info()
+
+    print 'Simulating {0} fights against T{1} with {2} wounds'.format(args.iterations, args.toughness, args.wounds)
+    totals = parallel.run_sharded(fight_totals,
+                                  (weapon, character, extra_mods, args.toughness, args.wounds, args.start_frenzy,
+                                   args.frenzy_per_round, args.max_frenzy, args.max_rounds,
+                                   not args.reset_toughness, args.engine),
+                                  args.iterations, args.workers, args.seed)
+    print_turns(totals["turns"], float(args.iterations), args.max_rounds)
+    return True
+
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
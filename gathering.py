@@ -3,16 +3,13 @@
 # Monte Carlo sims for calculating values and success rate
 # for gathering herbs in KDM
 import argparse
-import copy
-import random
 import sys
 
-
-def roll_n_dice(n):
-    roll = []
-    for _ in range(n):
-        roll.append(random.randint(1, 10))
-    return roll
+import adaptive
+import dice
+import dice_exact
+import parallel
+import results
 
 
 def is_valid_roll(roll):
@@ -25,41 +22,117 @@ def roll_value(roll):
     return 0.0
 
 
-def gathering_sim(players, iterations):
-    print 'Calculating gathering for {0} players at {1} iterations'.format(players, iterations)
+def gathering_record(players, num_dice, method, iterations, table_total):
+    # one row for results.ResultWriter
+    return [("sim", "gathering"), ("players", players), ("num_dice", num_dice), ("method", method),
+            ("iterations", iterations), ("table_total", float(table_total))]
+
+
+def gathering_exact(players, max_dice, show_distribution, thresholds=(), writer=None):
+    print 'Calculating exact gathering for {0} players'.format(players)
+
+    for num_dice in range(2, max_dice + 1):
+        distribution = dice_exact.distinct_sum_distribution(num_dice)
+        table = dice_exact.table_distribution(num_dice, players)
+        print '{0} dice exact average is {1}'.format(num_dice, table.mean)
+        print '  table total percentiles: 10th {0}, median {1}, 90th {2}'.format(
+            table.percentile(0.1), table.percentile(0.5), table.percentile(0.9))
+        for threshold in thresholds:
+            print '  P(table total >= {0}): {1:.2f}%'.format(threshold, table.at_least(threshold) * 100.0)
+        if show_distribution:
+            distribution.print_info()
+        if writer:
+            writer.add(gathering_record(players, num_dice, "exact", 0, table.mean))
 
-    n_dice_avg = {}
-    for iteration in range(iterations):
-        for num_dice in range(2, 7):
-            table_total = 0.0
+
+def gathering_totals(players, max_dice, iterations):
+    n_dice_totals = {}
+    for num_dice in range(2, max_dice + 1):
+        n_dice_totals[num_dice] = 0.0
+
+    for _ in range(iterations):
+        for num_dice in range(2, max_dice + 1):
             for player in range(players):
-                table_total += roll_value(roll_n_dice(num_dice))
+                n_dice_totals[num_dice] += roll_value(dice.roll_n_dice(num_dice))
+    return {"table_total": n_dice_totals}
 
-            if iteration == 0:
-                n_dice_avg[num_dice] = table_total
-            elif iteration == 1:
-                n_dice_avg[num_dice] = (table_total + n_dice_avg[num_dice]) / 2
-            elif iteration >= 2:
-                # Cumulative moving average
-                n_dice_avg[num_dice] = (n_dice_avg[num_dice] * iteration + table_total) / (iteration + 1)
 
-        # print 'Table total for {0} dice is: {1}'.format(num_dice, table_total)
+def gathering_sim(players, iterations, max_dice=6, workers=1, seed=None, writer=None):
+    print 'Calculating gathering for {0} players at {1} iterations'.format(players, iterations)
+
+    totals = parallel.run_sharded(gathering_totals, (players, max_dice), iterations, workers, seed)
+    for num_dice in range(2, max_dice + 1):
+        print '{0} dice cumulative average is {1}'.format(num_dice, totals["table_total"][num_dice] / iterations)
+        if writer:
+            writer.add(gathering_record(players, num_dice, "sampled", iterations,
+                                        totals["table_total"][num_dice] / iterations))
 
-    for num_dice in range(2, 7):
-        print '{0} dice cumulative average is {1}'.format(num_dice, n_dice_avg[num_dice])
 
+def gathering_sample(players, max_dice):
+    table_totals = []
+    for num_dice in range(2, max_dice + 1):
+        table_total = 0.0
+        for player in range(players):
+            table_total += roll_value(dice.roll_n_dice(num_dice))
+        table_totals.append(table_total)
+    return table_totals
 
-def main():
+
+def gathering_adaptive(players, max_iterations, max_dice, target_se, batch_size=5000, seed=None, writer=None):
+    print 'Calculating gathering for {0} players to a standard error of {1}'.format(players, target_se)
+
+    results = adaptive.run_adaptive(lambda: gathering_sample(players, max_dice), range(2, max_dice + 1), target_se,
+                                    max_iterations, batch_size, seed)
+    print 'Stopped after {0} iterations'.format(results[2].count)
+    for num_dice in range(2, max_dice + 1):
+        print '{0} dice average is {1} +/- {2}'.format(num_dice, results[num_dice].mean,
+                                                      adaptive.margin(results[num_dice]))
+        if writer:
+            writer.add(gathering_record(players, num_dice, "adaptive", results[num_dice].count,
+                                        results[num_dice].mean))
+
+
+def gathering_progressive(players, max_iterations, max_dice, every, interval, seed, target_se=None):
+    snapshots = adaptive.progress_snapshots(lambda: gathering_sample(players, max_dice),
+                                            ['{0}_dice'.format(num_dice) for num_dice in range(2, max_dice + 1)],
+                                            max_iterations, every, interval, seed, target_se)
+    adaptive.print_progress(snapshots, sim="gathering", players=players)
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(prog="gathering",
                                      description='Calculate values and success chance for herb gathering in KD:M',
                                      add_help=True)
 
     parser.add_argument('--players', type=int, help='The number of players to sim', default=4)
     parser.add_argument('--iterations', type=int, help='The number of iterations to run', default=100000)
-
-    args = parser.parse_args()
-
-    gathering_sim(args.players, args.iterations)
+    parser.add_argument('--max_dice', type=int, help='The largest number of dice to roll', default=6)
+    parser.add_argument('--exact', action='store_true', help='Compute exact results instead of sampling')
+    parser.add_argument('--workers', type=int, help='The number of worker processes to shard iterations across',
+                        default=1)
+    parser.add_argument('--seed', type=int, help='Seed for reproducible runs', default=None)
+    parser.add_argument('--distribution', action='store_true',
+                        help='Print the single player sum distribution in exact mode')
+    parser.add_argument('--thresholds', type=int, nargs='+', default=[],
+                        help='Print the chance of the table total reaching each value in exact mode')
+    adaptive.add_adaptive_arguments(parser)
+    results.add_output_arguments(parser)
+
+    args = parser.parse_args(argv)
+    writer = results.open_writer(args)
+
+    if args.exact:
+        gathering_exact(args.players, args.max_dice, args.distribution, args.thresholds, writer)
+    elif adaptive.progress_requested(args):
+        gathering_progressive(args.players, args.iterations, args.max_dice, args.batch_size, args.progress_seconds,
+                              args.seed, adaptive.target_std_error(args))
+    elif adaptive.target_std_error(args):
+        gathering_adaptive(args.players, args.iterations, args.max_dice, adaptive.target_std_error(args),
+                           args.batch_size, args.seed, writer)
+    else:
+        gathering_sim(args.players, args.iterations, args.max_dice, args.workers, args.seed, writer)
+    if writer:
+        writer.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+# instrument.py
+#
+# Opt-in instrumentation for attack_sim. InstrumentedRulePlan behaves and
+# consumes dice exactly like RulePlan, but counts rule activations and
+# dice and times the hit roll, wound roll and post-wound stages. It is
+# used by the "instrumented" engine, so the plain RulePlan loop carries no
+# counters at all.
+import timeit
+
+import attack_sim
+import dice
+import wound_tables
+
+
+COUNTERS = [
+    "attacks",
+    "early_iron_failures",
+    "hit_dice",
+    "combo_master_dice",
+    "tens",
+    "wound_rolls",
+    "wound_roll_successes",
+    "axe_spec_retries",
+    "auto_wounds",
+    "wound_draws",
+    "sharp_dice",
+    "butcher_dice",
+    "butcher_cancellations",
+]
+STAGES = ["hit_roll", "wound_roll", "post_wound"]
+
+
+class InstrumentedRulePlan(attack_sim.RulePlan):
+    def __init__(self, weapon, character, extra_mods):
+        attack_sim.RulePlan.__init__(self, weapon, character, extra_mods)
+        self.counts = dict((name, 0) for name in COUNTERS)
+        self.seconds = dict((stage, 0.0) for stage in STAGES)
+        self.hook_extra_wounds = 0.0
+        self.wound_hooks = [self.instrument_hook(hook) for hook in self.wound_hooks]
+
+    def instrument_hook(self, hook):
+        calls = hook.__name__ + "_calls"
+        extra = hook.__name__ + "_wounds"
+        self.counts[calls] = 0
+        self.counts[extra] = 0
+
+        def instrumented(plan, state, wound_roll):
+            start = timeit.default_timer()
+            wounds = hook(plan, state, wound_roll)
+            self.seconds["post_wound"] += timeit.default_timer() - start
+            self.counts[calls] += 1
+            self.counts[extra] += wounds
+            self.hook_extra_wounds += wounds
+            return wounds
+        return instrumented
+
+    def roll_hit_dice(self):
+        start = timeit.default_timer()
+        hit_rolls, str, early_iron_failure = attack_sim.RulePlan.roll_hit_dice(self)
+        self.seconds["hit_roll"] += timeit.default_timer() - start
+        counts = self.counts
+        counts["attacks"] += 1
+        counts["hit_dice"] += len(hit_rolls)
+        counts["combo_master_dice"] += len(hit_rolls) - self.speed
+        counts["tens"] += hit_rolls.count(10)
+        counts["early_iron_failures"] += bool(early_iron_failure)
+        return hit_rolls, str, early_iron_failure
+
+    def is_wound(self, roll, str, toughness):
+        # mirrors RulePlan.is_wound draw for draw. The pre-Butcher chance
+        # splits the same uniform draw, below chance is a wound and from
+        # there up to the pre-Butcher chance is a wound Butcher cancelled.
+        counts = self.counts
+        counts["wound_rolls"] += 1
+        chance = self.wound_table(str, toughness)[roll]
+        if roll == 1 or roll == 10:
+            wound = chance == 1.0
+        else:
+            if self.sharp:
+                counts["sharp_dice"] += 1
+            if chance == 1.0 or chance == 0.0:
+                # Butcher always leaves a chance to draw for
+                wound = chance == 1.0
+            else:
+                counts["wound_draws"] += 1
+                draw = dice.uniform()
+                wound = draw < chance
+                if self.butcher:
+                    before_butcher = wound_tables.wound_table(str, toughness, self.sharp, False)[roll]
+                    if draw < before_butcher:
+                        counts["butcher_dice"] += 1
+                        if not wound:
+                            counts["butcher_cancellations"] += 1
+        if wound:
+            counts["wound_roll_successes"] += 1
+        return wound
+
+    def resolve_wounds(self, hit_rolls, str, toughness, state=None):
+        start = timeit.default_timer()
+        post_wound = self.seconds["post_wound"]
+        successes = self.counts["wound_roll_successes"]
+        hook_extra_wounds = self.hook_extra_wounds
+        if state is None:
+            state = attack_sim.AttackState(self, toughness)
+        hits, wounds = attack_sim.RulePlan.resolve_wounds(self, hit_rolls, str, toughness, state)
+        self.counts["axe_spec_retries"] += self.axe_spec and not state.axe_spec
+        # whatever wasn't rolled for or added by a hook was an automatic wound
+        self.counts["auto_wounds"] += int(wounds - (self.counts["wound_roll_successes"] - successes) -
+                                          (self.hook_extra_wounds - hook_extra_wounds))
+        self.seconds["wound_roll"] += timeit.default_timer() - start - (self.seconds["post_wound"] - post_wound)
+        return hits, wounds
+
+    def instrumentation(self):
+        counts = dict(self.counts)
+        # Sharp and Butcher dice are folded into wound draws, but still
+        # counted as the dice the rules call for
+        counts["dice"] = counts["hit_dice"] + counts["wound_rolls"] + counts["sharp_dice"] + counts["butcher_dice"]
+        return {"counts": counts, "seconds": dict(self.seconds)}
+
+
+def print_instrumentation(instrumentation):
+    counts = instrumentation["counts"]
+    attacks = float(counts["attacks"]) or 1.0
+    print 'Rule activations per attack:'
+    for name in sorted(counts):
+        if name != "attacks" and counts[name]:
+            print '  {0}: {1:.4f}'.format(name, counts[name] / attacks)
+    print 'Time per attack: {0}'.format(', '.join(
+        '{0} {1:.2f} us'.format(stage.replace("_", " "), instrumentation["seconds"][stage] / attacks * 1e6)
+        for stage in STAGES))
@@ -0,0 +1,115 @@
+# kdm_dice.py
+#
+# Single entry point for all of the simulators, installed as kdm-dice.
+# Each subcommand's module is imported only when that subcommand runs, so
+# --help and small runs don't pay for loading every simulator (or NumPy).
+# --batch runs one command line per line of a file in a single process,
+# so modules, the weapon/character catalog and exact tables are loaded
+# once for the whole batch.
+#
+# Examples:
+#   kdm-dice attack "Bone Axe" --character Xena --exact
+#   kdm-dice delving --exact --all
+#   kdm-dice --batch runs.txt
+import importlib
+import shlex
+import sys
+
+
+# (subcommand, module, description)
+COMMANDS = [
+    ("attack", "attack_sim", "Calculate dice rolls for an attack"),
+    ("delving", "delving", "Mining results for delving"),
+    ("gathering", "gathering", "Values for herb gathering"),
+    ("maw", "run_into_maw", "Values and fail chance for running into the maw"),
+    ("fight", "fight", "Whole fights round by round"),
+    ("sweep", "sweep", "attack over a grid of configurations"),
+    ("policy", "delving_policy", "Best delving policy for a utility"),
+    ("loadout", "loadout_optimizer", "Rank weapons and extra mods for a character"),
+    ("compare", "compare", "Compare loadouts with common random numbers"),
+    ("benchmark", "benchmark", "Benchmark the hot paths and check engine equivalence"),
+    ("serve", "server", "Serve simulations over local HTTP"),
+]
+MODULES = dict((command, module) for command, module, description in COMMANDS)
+
+
+def usage():
+    lines = ['usage: kdm-dice <command> [arguments]',
+             '       kdm-dice --batch <file>',
+             '',
+             'Kingdom Death: Monster dice simulators.',
+             '',
+             'commands:']
+    for command, module, description in COMMANDS:
+        lines.append('  {0:<11}{1}'.format(command, description))
+    lines.append('')
+    lines.append('Run "kdm-dice <command> --help" for the arguments of a command. A --batch file holds one')
+    lines.append('command line per line, e.g. "attack \\"Bone Axe\\" --character Xena --toughness 12"; blank lines')
+    lines.append('and lines starting with # are skipped.')
+    return '\n'.join(lines)
+
+
+def run_command(argv):
+    if not argv or argv[0] not in MODULES:
+        raise RuntimeError('Unknown command: {0}, expected one of: {1}'.format(
+            argv[0] if argv else '', ', '.join(command for command, module, description in COMMANDS)))
+    module = importlib.import_module(MODULES[argv[0]])
+    # the original scripts return None on success, only False is a failure
+    return module.main(argv[1:]) is not False
+
+
+def run_batch(path):
+    with open(path, "r") as read_file:
+        lines = read_file.readlines()
+    failures = 0
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        print '\n[{0}:{1}] {2}'.format(path, line_number, line)
+        sys.stdout.flush()
+        try:
+            succeeded = run_command(shlex.split(line))
+        except SystemExit as error:
+            # argparse exits on bad arguments and --help
+            succeeded = error.code in (None, 0)
+        except RuntimeError as error:
+            print 'ERROR [{0}:{1}]: {2}'.format(path, line_number, error)
+            succeeded = False
+        except Exception as error:
+            # e.g. a missing input file, one bad line doesn't stop the batch
+            print 'ERROR [{0}:{1}]: {2}: {3}'.format(path, line_number, type(error).__name__, error)
+            succeeded = False
+        if not succeeded:
+            failures += 1
+    if failures:
+        print '\n{0} batch command(s) failed'.format(failures)
+    return not failures
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or argv[0] in ("-h", "--help"):
+        print usage()
+        return bool(argv)
+    if argv[0] == "--batch":
+        if len(argv) != 2:
+            print usage()
+            return False
+        return run_batch(argv[1])
+    if argv[0] not in MODULES:
+        print usage()
+        print '\nUnknown command: {0}'.format(argv[0])
+        return False
+    return run_command(argv)
+
+
+def run():
+    # console_scripts entry point, sys.exit(True) would be a failure
+    return 0 if main() else 1
+
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
@@ -0,0 +1,175 @@
+# loadout_optimizer.py
+#
+# Ranks every weapon in the catalog and every legal combination of extra
+# mods for one character against one monster toughness, by expected
+# wounds or by the chance of dealing at least --kill wounds. Loadouts the
+# exact evaluator can walk cheaply are scored exactly. The rest, such as
+# double Combo Master with Mighty Attack, race through successive
+# halving: each round every survivor gets a bigger iteration budget,
+# anything whose 95% upper bound falls below the best lower bound is
+# dropped, and only the better half goes on to the next round.
+#
+# Example:
+#   python loadout_optimizer.py --character Xena --toughness 12 --kill 2
+import argparse
+import sys
+
+import adaptive
+import attack_exact
+import attack_sim
+import catalog
+import dice
+import stats
+
+
+# extra mods a player can choose, and the weapon tags that make each legal
+MOD_REQUIREMENTS = [
+    ("Axe Spec", ["Axe"]),
+    ("Grand Spec", ["Grand Weapon"]),
+    ("White Lion Set", ["Dagger", "Katar"]),
+    ("Paired", ["Paired"]),
+    ("Strategist", ["Bow"]),
+    ("Screaming Set", ["Spear"]),
+]
+
+
+def legal_mods(weapon_data, character):
+    tags = weapon_data.get("special mods", [])
+    return [mod for mod, required in MOD_REQUIREMENTS
+            if mod not in character.fighting_arts and any(tag in tags for tag in required)]
+
+
+def mod_combinations(mods):
+    combinations = [[]]
+    for mod in mods:
+        combinations = [combination + extra for combination in combinations for extra in ([], [mod])]
+    return combinations
+
+
+class Candidate(object):
+    def __init__(self, weapon_name, character_name, extra_mods, toughness, kill):
+        weapon = attack_sim.load_weapon_data(weapon_name)
+        character = attack_sim.load_character_data(character_name)
+        attack_sim.apply_extra_mods(weapon, character, extra_mods)
+        self.weapon_name = weapon_name
+        self.extra_mods = extra_mods
+        self.toughness = toughness
+        self.kill = kill
+        self.plan = attack_sim.RulePlan(weapon, character, extra_mods)
+        # exact only when attack_exact estimates the walk is cheap
+        self.exact = not attack_exact.unsupported_mods(self.plan, self.toughness)
+        self.score = stats.RunningStats()
+        self.value = None
+        self.pruned_at = None
+
+    def evaluate_exact(self):
+        # the cost was already checked in __init__
+        distribution = attack_exact.evaluate(self.plan, self.toughness, max_cost=None).distribution
+        if self.kill:
+            chances = distribution.exceedance(1)
+            self.value = chances[min(self.kill, len(chances) - 1)]
+        else:
+            self.value = sum(value * chance for value, chance in enumerate(distribution.marginal(1)))
+
+    def sample(self, iterations):
+        plan = self.plan
+        toughness = self.toughness
+        kill = self.kill
+        score = self.score
+        for _ in range(iterations):
+            hits, wounds, context = plan.attack(toughness)
+            if kill:
+                score.add(1.0 if wounds >= kill else 0.0)
+            else:
+                score.add(wounds)
+        self.value = score.mean
+
+    def bounds(self):
+        if self.exact:
+            return self.value, self.value
+        margin = adaptive.margin(self.score)
+        return self.value - margin, self.value + margin
+
+
+def build_candidates(character_name, toughness, kill, weapon_names=None):
+    data = catalog.default_catalog()
+    character = attack_sim.load_character_data(character_name)
+    candidates = []
+    for weapon_name in weapon_names or data.weapon_names():
+        for extra_mods in mod_combinations(legal_mods(data.weapon_data(weapon_name), character)):
+            candidates.append(Candidate(weapon_name, character_name, extra_mods, toughness, kill))
+    return candidates
+
+
+def race(candidates, initial_iterations, rounds):
+    # successive halving over the loadouts that have to be sampled
+    for candidate in candidates:
+        if candidate.exact:
+            candidate.evaluate_exact()
+    racing = [candidate for candidate in candidates if not candidate.exact]
+    budget = initial_iterations
+    for round_number in range(rounds):
+        if not racing:
+            break
+        for candidate in racing:
+            candidate.sample(budget)
+        best_lower = max(candidate.bounds()[0] for candidate in candidates if candidate.value is not None)
+        survivors = []
+        for candidate in racing:
+            if candidate.bounds()[1] < best_lower:
+                candidate.pruned_at = candidate.score.count
+            else:
+                survivors.append(candidate)
+        survivors.sort(key=lambda candidate: -candidate.value)
+        if round_number < rounds - 1 and len(survivors) > 1:
+            for candidate in survivors[(len(survivors) + 1) // 2:]:
+                candidate.pruned_at = candidate.score.count
+            survivors = survivors[:(len(survivors) + 1) // 2]
+        racing = survivors
+        budget *= 2
+    return sorted(candidates, key=lambda candidate: -candidate.value)
+
+
+def print_ranking(ranked, kill, top):
+    metric = 'P(wounds >= {0})'.format(kill) if kill else 'Expected wounds'
+    print '{0:<4} {1:<22} {2:<36} {3:>16}'.format('Rank', 'Weapon', 'Extra mods', metric)
+    for rank, candidate in enumerate(ranked[:top], 1):
+        if candidate.exact:
+            note = 'exact'
+        else:
+            note = '+/- {0:.3f} after {1} iterations'.format(adaptive.margin(candidate.score), candidate.score.count)
+            if candidate.pruned_at:
+                note += ', pruned'
+        print '{0:<4} {1:<22} {2:<36} {3:>16.3f}  {4}'.format(rank, candidate.weapon_name,
+                                                              ', '.join(candidate.extra_mods) or '-',
+                                                              candidate.value, note)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="loadout_optimizer",
+                                     description='Rank KD:M weapons and extra mods for a character',
+                                     add_help=True)
+    parser.add_argument('--character', type=str, help='The name of the character to use', default="Default")
+    parser.add_argument('--toughness', type=int, help='The toughness of the monster', default=12)
+    parser.add_argument('--kill', type=int, default=0,
+                        help='Rank by the chance of at least this many wounds instead of expected wounds')
+    parser.add_argument('--weapons', type=str, nargs='+', help='Only consider these weapons', default=None)
+    parser.add_argument('--iterations', type=int, help='Iterations per loadout in the first racing round',
+                        default=2000)
+    parser.add_argument('--rounds', type=int, help='Racing rounds, the budget doubles each round', default=5)
+    parser.add_argument('--top', type=int, help='The number of loadouts to print', default=20)
+    parser.add_argument('--seed', type=int, help='Seed for reproducible runs', default=None)
+
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        dice.seed(args.seed)
+    candidates = build_candidates(args.character, args.toughness, args.kill, args.weapons)
+    print 'Ranking {0} loadouts for \"{1}\" at T{2}'.format(len(candidates), args.character, args.toughness)
+    print_ranking(race(candidates, args.iterations, args.rounds), args.kill, args.top)
+    return True
+
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
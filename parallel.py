@@ -0,0 +1,71 @@
+# parallel.py
+#
+# Shared process pool runner for the simulators. Iterations are split into
+# shards, each shard runs in its own worker process with an independent,
+# reproducible dice stream spawned from the seed, and the per-shard sums and counts are merged
+# exactly instead of averaging averages.
+import random
+
+import dice
+
+
+def shard_iterations(iterations, shards):
+    base, remainder = divmod(iterations, shards)
+    return [base + 1 if shard < remainder else base for shard in range(shards)]
+
+
+def shard_streams(seed, shards):
+    return dice.DiceStream(seed).spawn(shards)
+
+
+def merge_totals(totals, other):
+    for key, value in other.items():
+        if isinstance(value, dict):
+            merge_totals(totals.setdefault(key, {}), value)
+        elif hasattr(value, "merge"):
+            if key in totals:
+                totals[key].merge(value)
+            else:
+                totals[key] = value
+        else:
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def run_shard(job):
+    func, args, iterations, stream = job
+    if stream is None:
+        return func(*(args + (iterations,)))
+    dice.use_stream(stream)
+    try:
+        return func(*(args + (iterations,)))
+    finally:
+        dice.use_stream()
+
+
+def run_sharded(func, args, iterations, workers=1, seed=None):
+    # func(*args, iterations) must be a module level function returning a
+    # (possibly nested) dict of sums, or of objects with a merge method such
+    # as stats.JointHistogram, so the shards can be merged exactly
+    if workers <= 1:
+        stream = shard_streams(seed, 1)[0] if seed is not None else None
+        return run_shard((func, args, iterations, stream))
+
+    if seed is None:
+        # forked workers would otherwise all share the parent's stream
+        seed = random.SystemRandom().getrandbits(64)
+    jobs = zip([func] * workers, [args] * workers, shard_iterations(iterations, workers),
+               shard_streams(seed, workers))
+    # only sharded runs pay for importing multiprocessing
+    import multiprocessing
+    pool = multiprocessing.Pool(workers)
+    try:
+        shard_totals = pool.map(run_shard, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    totals = {}
+    for shard_total in shard_totals:
+        merge_totals(totals, shard_total)
+    return totals
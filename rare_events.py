@@ -0,0 +1,128 @@
+# rare_events.py
+#
+# Importance sampling for rare outcomes, such as Lantern City gear, death
+# while delving or a big wound count from one attack. Samples are rolled
+# with dice.TiltedStream, which biases each die of a sample toward the
+# event and keeps the likelihood ratio, so the mean of weight * hit is an
+# unbiased estimate of the chance under fair dice.
+#
+# The tilts are learned with the cross-entropy method. Each pilot round
+# rolls under the current tilts, takes the top rho fraction of samples by
+# score (or every sample that hits the event once enough do) and refits
+# the face chances of every die position to their weighted faces. The
+# refit is smoothed toward the previous tilts and mixed with fair dice, so
+# no face ever becomes impossible and the weights stay bounded.
+import adaptive
+import dice
+import stats
+
+
+RHO = 0.1
+SMOOTHING = 0.7
+FAIR_MIX = 0.1
+MAX_POSITIONS = 32
+
+
+def add_rare_arguments(parser):
+    parser.add_argument('--rare_pilot', type=int, default=2000,
+                        help='Samples per cross-entropy round used to learn the dice tilts for rare events')
+    parser.add_argument('--rare_rounds', type=int, default=10,
+                        help='The most cross-entropy rounds before estimating a rare event')
+
+
+def run_tilted(sample, score, tilts, iterations):
+    # (score, weight, faces) of iterations samples rolled under tilts
+    stream = dice.TiltedStream(tilts, dice.getrandbits(64))
+    runs = []
+    dice.use_stream(stream)
+    try:
+        for _ in range(iterations):
+            stream.start()
+            runs.append((score(sample()), stream.weight, stream.faces))
+    finally:
+        dice.use_stream()
+    return runs
+
+
+def elite_level(scores, threshold, previous=None, rho=RHO):
+    # the 1 - rho quantile of the scores, capped at the event threshold.
+    # Scores are discrete, so when that doesn't beat the previous level
+    # (or the lowest score) the next score up is used and rounds always
+    # make progress.
+    scores = sorted(scores)
+    level = min(scores[min(int((1.0 - rho) * len(scores)), len(scores) - 1)], threshold)
+    floor = scores[0] if previous is None else previous
+    higher = [value for value in scores if value > floor]
+    if level <= floor and higher:
+        level = min(min(higher), threshold)
+    return level
+
+
+def refit(tilts, elite, smoothing=SMOOTHING, fair_mix=FAIR_MIX):
+    positions = min(max(len(faces) for weight, faces in elite), MAX_POSITIONS)
+    counts = [[0.0] * 10 for _ in range(positions)]
+    for weight, faces in elite:
+        for position, face in enumerate(faces[:positions]):
+            counts[position][face - 1] += weight
+    fitted = []
+    for position in range(positions):
+        previous = tilts[position] if position < len(tilts) else [0.1] * 10
+        total = sum(counts[position])
+        if not total:
+            fitted.append(previous)
+            continue
+        fitted.append([(1.0 - fair_mix) * (smoothing * count / total + (1.0 - smoothing) * chance) + fair_mix * 0.1
+                       for count, chance in zip(counts[position], previous)])
+    return fitted
+
+
+def learn_tilts(sample, score, threshold, pilot, rounds):
+    # returns the tilts and the number of pilot rounds used
+    tilts = []
+    level = None
+    for round_number in range(1, rounds + 1):
+        runs = run_tilted(sample, score, tilts, pilot)
+        level = elite_level([value for value, weight, faces in runs], threshold, level)
+        elite = [(weight, faces) for value, weight, faces in runs if value >= level and faces]
+        if elite:
+            tilts = refit(tilts, elite)
+        if level >= threshold:
+            return tilts, round_number
+    return tilts, rounds
+
+
+def estimate(sample, score, threshold, iterations, pilot=2000, rounds=10, seed=None):
+    # RunningStats of weight * hit, whose mean is the chance of the event
+    if seed is not None:
+        dice.seed(seed)
+    tilts, used_rounds = learn_tilts(sample, score, threshold, pilot, rounds)
+    accumulator = stats.RunningStats()
+    for value, weight, faces in run_tilted(sample, score, tilts, iterations):
+        accumulator.add(weight if value >= threshold else 0.0)
+    return accumulator, used_rounds
+
+
+def relative_error(accumulator):
+    if not accumulator.mean:
+        return float("inf")
+    return accumulator.std_error / accumulator.mean
+
+
+def plain_iterations(accumulator):
+    # plain samples needed for the same standard error, p(1 - p) / se^2
+    chance = accumulator.mean
+    if not chance or not accumulator.variance:
+        return None
+    return int(chance * (1.0 - chance) / accumulator.std_error ** 2)
+
+
+def print_estimate(label, accumulator, iterations, pilot, used_rounds):
+    print '{0}: {1:.6f}% +/- {2:.6f}%, relative error {3:.2f}%'.format(
+        label, accumulator.mean * 100.0, adaptive.margin(accumulator, 100.0), relative_error(accumulator) * 100.0)
+    plain = plain_iterations(accumulator)
+    total = iterations + pilot * used_rounds
+    if plain:
+        print '  {0} iterations ({1} pilot), plain sampling would need about {2} for the same precision'.format(
+            total, pilot * used_rounds, plain)
+    elif not accumulator.mean:
+        print '  {0} iterations ({1} pilot), the event was never reached'.format(total, pilot * used_rounds)
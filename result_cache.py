@@ -0,0 +1,115 @@
+# result_cache.py
+#
+# On-disk cache of simulation sufficient statistics keyed by a canonical
+# hash of the resolved configuration. A later run asking for more
+# iterations only simulates the difference and merges it in. Weapon and
+# character stats are part of the key, so editing weapon_data.json or
+# characters.json stops the affected entries from matching and they age
+# out through the least recently used eviction.
+import hashlib
+import json
+import os
+
+import parallel
+import stats
+
+
+def config_key(config):
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def top_up_seed(seed, done):
+    # an independent stream for iterations after the first `done`, the
+    # first run uses the seed as given so it matches an uncached run
+    if seed is None or not done:
+        return seed
+    digest = hashlib.sha1("{0}:{1}".format(seed, done).encode("utf-8")).hexdigest()
+    return int(digest[:16], 16)
+
+
+def encode_totals(totals):
+    encoded = {}
+    for key, value in totals.items():
+        if isinstance(value, dict):
+            encoded[key] = encode_totals(value)
+        elif isinstance(value, stats.JointHistogram):
+            encoded[key] = {"__histogram__": value.counts, "size": value.size}
+        else:
+            encoded[key] = value
+    return encoded
+
+
+def decode_totals(encoded):
+    totals = {}
+    for key, value in encoded.items():
+        if isinstance(value, dict) and "__histogram__" in value:
+            histogram = stats.JointHistogram(value["size"])
+            histogram.counts = value["__histogram__"]
+            totals[key] = histogram
+        elif isinstance(value, dict):
+            totals[key] = decode_totals(value)
+        else:
+            totals[key] = value
+    return totals
+
+
+class ResultCache(object):
+    def __init__(self, path, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def load(self, key):
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path, "r") as read_file:
+                entry = json.load(read_file)
+        except (IOError, OSError, ValueError):
+            return None
+        # the file mtime doubles as the last access time for eviction
+        os.utime(entry_path, None)
+        return entry
+
+    def store(self, key, config, iterations, totals):
+        entry = {"config": config, "iterations": iterations, "totals": encode_totals(totals)}
+        temp_path = self.entry_path(key) + ".tmp"
+        with open(temp_path, "w") as write_file:
+            json.dump(entry, write_file)
+        os.rename(temp_path, self.entry_path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(".json"):
+                entry_stat = os.stat(os.path.join(self.path, file_name))
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, file_name))
+        entries.sort()
+        total_bytes = sum(size for mtime, size, file_name in entries)
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            mtime, size, file_name = entries.pop(0)
+            os.remove(os.path.join(self.path, file_name))
+            total_bytes -= size
+
+    def run(self, config, func, args, iterations, workers=1, seed=None):
+        # returns merged totals and the number of iterations they cover,
+        # which may be more than requested if the cache already had them
+        key = config_key(config)
+        entry = self.load(key)
+        done = 0
+        totals = {}
+        if entry:
+            done = entry["iterations"]
+            totals = decode_totals(entry["totals"])
+        if done < iterations:
+            extra = parallel.run_sharded(func, args, iterations - done, workers, top_up_seed(seed, done))
+            parallel.merge_totals(totals, extra)
+            done = iterations
+            self.store(key, config, done, totals)
+        return totals, done
@@ -0,0 +1,162 @@
+# results.py
+#
+# Structured output shared by the simulators. Records (config columns plus
+# statistic columns) are collected into column buffers and written out a
+# block at a time as CSV, JSON Lines or a compact binary columnar format,
+# appending to the file so a long sweep never holds all of its rows.
+#
+# The columnar format is the magic line "KDMC1\n" followed by blocks. Each
+# block is a little-endian uint32 header length, a JSON header
+# {"rows": n, "columns": [[name, type], ...]} and then every column in
+# order: "f8" float64s, "i8" int64s, "b1" one byte per bool, or "str" as
+# uint32 byte lengths followed by the UTF-8 data. read_columnar() reads
+# it back a block at a time.
+import collections
+import csv
+import json
+import os
+import struct
+
+
+FORMATS = ["csv", "jsonl", "columnar"]
+EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".kdmc": "columnar"}
+MAGIC = "KDMC1\n"
+BLOCK_ROWS = 4096
+
+
+def add_output_arguments(parser):
+    parser.add_argument('--output', type=str, help='Append structured results to this file', default=None)
+    parser.add_argument('--format', type=str, choices=FORMATS, default=None,
+                        help='Format of --output, by default taken from its extension (.csv, .jsonl, .kdmc)')
+
+
+def open_writer(args):
+    if not args.output:
+        return None
+    return ResultWriter(args.output, args.format)
+
+
+def column_type(values):
+    if all(isinstance(value, bool) for value in values):
+        return "b1"
+    if all(isinstance(value, (int, long)) and not isinstance(value, bool) for value in values):
+        return "i8"
+    if all(isinstance(value, (int, long, float)) or value is None for value in values):
+        return "f8"
+    return "str"
+
+
+def text(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, float):
+        # str() rounds floats to 12 digits, repr() round trips them
+        return repr(value)
+    return str(value)
+
+
+def pack_column(values, kind):
+    if kind == "f8":
+        return struct.pack('<{0}d'.format(len(values)), *[float("nan") if value is None else value
+                                                          for value in values])
+    if kind == "i8":
+        return struct.pack('<{0}q'.format(len(values)), *values)
+    if kind == "b1":
+        return struct.pack('<{0}B'.format(len(values)), *values)
+    encoded = [text(value) for value in values]
+    return struct.pack('<{0}I'.format(len(encoded)), *[len(value) for value in encoded]) + ''.join(encoded)
+
+
+def unpack_column(read_file, rows, kind):
+    if kind in ("f8", "i8", "b1"):
+        code, size = {"f8": ("d", 8), "i8": ("q", 8), "b1": ("B", 1)}[kind]
+        values = list(struct.unpack('<{0}{1}'.format(rows, code), read_file.read(rows * size)))
+        if kind == "b1":
+            values = [bool(value) for value in values]
+        return values
+    lengths = struct.unpack('<{0}I'.format(rows), read_file.read(rows * 4))
+    return [read_file.read(length).decode("utf-8") for length in lengths]
+
+
+class ResultWriter(object):
+    def __init__(self, path, format=None, block_rows=BLOCK_ROWS):
+        if format is None:
+            format = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if format not in FORMATS:
+            raise RuntimeError('Unknown output format for {0}, use --format {1}'.format(path, '|'.join(FORMATS)))
+        self.path = path
+        self.format = format
+        self.block_rows = block_rows
+        self.names = None
+        self.columns = {}
+        self.rows = 0
+        self.header = None
+        if format == "csv" and os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as read_file:
+                self.header = next(csv.reader(read_file))
+
+    def add(self, record):
+        # record is a sequence of (column, value) pairs, so column order is
+        # kept in the output
+        names = [name for name, value in record]
+        if self.names is None:
+            self.names = names
+            self.columns = dict((name, []) for name in self.names)
+        if names != self.names:
+            raise RuntimeError('Record columns {0} do not match {1}'.format(names, self.names))
+        for name, value in record:
+            self.columns[name].append(value)
+        self.rows += 1
+        if self.rows >= self.block_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        with open(self.path, "ab") as write_file:
+            getattr(self, "write_" + self.format)(write_file)
+        self.columns = dict((name, []) for name in self.names)
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+
+    def write_csv(self, write_file):
+        writer = csv.writer(write_file)
+        if self.header is None:
+            self.header = self.names
+            writer.writerow(self.header)
+        elif sorted(self.header) != sorted(self.names):
+            raise RuntimeError('Columns {0} do not match the existing {1}'.format(self.names, self.path))
+        columns = [self.columns[name] for name in self.header]
+        writer.writerows([['' if value is None else text(value) for value in row] for row in zip(*columns)])
+
+    def write_jsonl(self, write_file):
+        columns = [self.columns[name] for name in self.names]
+        for row in zip(*columns):
+            write_file.write(json.dumps(collections.OrderedDict(zip(self.names, row))) + "\n")
+
+    def write_columnar(self, write_file):
+        if not os.path.getsize(self.path):
+            write_file.write(MAGIC)
+        kinds = [column_type(self.columns[name]) for name in self.names]
+        header = json.dumps({"rows": self.rows, "columns": zip(self.names, kinds)})
+        write_file.write(struct.pack('<I', len(header)) + header)
+        for name, kind in zip(self.names, kinds):
+            write_file.write(pack_column(self.columns[name], kind))
+
+
+def read_columnar(path):
+    # yields each block as a dict of column name to values
+    with open(path, "rb") as read_file:
+        if read_file.read(len(MAGIC)) != MAGIC:
+            raise RuntimeError('Not a columnar results file: {0}'.format(path))
+        while True:
+            size = read_file.read(4)
+            if not size:
+                return
+            header = json.loads(read_file.read(struct.unpack('<I', size)[0]))
+            block = {}
+            for name, kind in header["columns"]:
+                block[name] = unpack_column(read_file, header["rows"], kind)
+            yield block
@@ -3,16 +3,13 @@
 # Monte Carlo sims for calculating values and success rate
 # for running into the maw in KDM
 import argparse
-import copy
-import random
 import sys
 
-
-def roll_n_dice(n):
-    roll = []
-    for _ in range(n):
-        roll.append(random.randint(1, 10))
-    return roll
+import adaptive
+import dice
+import dice_exact
+import parallel
+import results
 
 
 def is_valid_roll(roll):
@@ -25,45 +22,123 @@ def roll_value(roll):
     return 0.0
 
 
-def maw_sim(iterations):
-    print 'Calculating maw chances at {0} iterations'.format(iterations)
+def maw_record(num_dice, method, iterations, total, fail_chance):
+    # one row for results.ResultWriter
+    return [("sim", "maw"), ("num_dice", num_dice), ("method", method), ("iterations", iterations),
+            ("total", float(total)), ("fail_chance", float(fail_chance))]
+
+
+def maw_exact(max_dice, show_distribution, writer=None):
+    print 'Calculating exact maw chances'
+
+    for num_dice in range(2, max_dice + 1):
+        distribution = dice_exact.distinct_sum_distribution(num_dice)
+        print '{0} dice exact average is {1}, fail chance is {2:.1f}'.format(num_dice, distribution.mean,
+                                                                            distribution.fail_chance * 100.0)
+        if show_distribution:
+            distribution.print_info()
+        if writer:
+            writer.add(maw_record(num_dice, "exact", 0, distribution.mean, distribution.fail_chance))
+
 
-    n_dice_avg = {}
+def maw_totals(max_dice, iterations):
+    n_dice_totals = {}
     n_dice_failures = {}
-    for num_dice in range(2, 7):
+    for num_dice in range(2, max_dice + 1):
+        n_dice_totals[num_dice] = 0.0
         n_dice_failures[num_dice] = 0.0
 
-    for iteration in range(iterations):
-        for num_dice in range(2, 7):
-            total = roll_value(roll_n_dice(num_dice))
+    for _ in range(iterations):
+        for num_dice in range(2, max_dice + 1):
+            total = roll_value(dice.roll_n_dice(num_dice))
             if total == 0.0:
                 n_dice_failures[num_dice] += 1.0
+            n_dice_totals[num_dice] += total
+    return {"total": n_dice_totals, "failures": n_dice_failures}
 
-            if iteration == 0:
-                n_dice_avg[num_dice] = total
-            elif iteration == 1:
-                n_dice_avg[num_dice] = (total + n_dice_avg[num_dice]) / 2.0
-            elif iteration >= 2:
-                # Cumulative moving average
-                n_dice_avg[num_dice] = (n_dice_avg[num_dice] * iteration + total) / (iteration + 1.0)
-
-        # print 'Table total for {0} dice is: {1}'.format(num_dice, total)
-
-    for num_dice in range(2, 7):
-        print '{0} dice cumulative average is {1}, fail chance is {2:.1f}'.format(num_dice, n_dice_avg[num_dice], (n_dice_failures[num_dice] / iterations) * 100.0)
 
+def maw_sim(iterations, max_dice=6, workers=1, seed=None, writer=None):
+    print 'Calculating maw chances at {0} iterations'.format(iterations)
 
-def main():
+    totals = parallel.run_sharded(maw_totals, (max_dice,), iterations, workers, seed)
+    for num_dice in range(2, max_dice + 1):
+        print '{0} dice cumulative average is {1}, fail chance is {2:.1f}'.format(
+            num_dice, totals["total"][num_dice] / iterations, (totals["failures"][num_dice] / iterations) * 100.0)
+        if writer:
+            writer.add(maw_record(num_dice, "sampled", iterations, totals["total"][num_dice] / iterations,
+                                  totals["failures"][num_dice] / iterations))
+
+
+def maw_sample(max_dice):
+    values = []
+    for num_dice in range(2, max_dice + 1):
+        total = roll_value(dice.roll_n_dice(num_dice))
+        values.append(total)
+        values.append(1.0 if total == 0.0 else 0.0)
+    return values
+
+
+def maw_adaptive(max_iterations, max_dice, target_se, batch_size=5000, seed=None, writer=None):
+    print 'Calculating maw chances to a standard error of {0}'.format(target_se)
+
+    names = []
+    for num_dice in range(2, max_dice + 1):
+        names.append((num_dice, "total"))
+        names.append((num_dice, "failures"))
+    results = adaptive.run_adaptive(lambda: maw_sample(max_dice), names, target_se, max_iterations, batch_size,
+                                    seed)
+    print 'Stopped after {0} iterations'.format(results[(2, "total")].count)
+    for num_dice in range(2, max_dice + 1):
+        total = results[(num_dice, "total")]
+        failures = results[(num_dice, "failures")]
+        print '{0} dice average is {1} +/- {2}, fail chance is {3:.1f} +/- {4:.1f}'.format(
+            num_dice, total.mean, adaptive.margin(total), failures.mean * 100.0, adaptive.margin(failures, 100.0))
+        if writer:
+            writer.add(maw_record(num_dice, "adaptive", total.count, total.mean, failures.mean))
+
+
+def maw_progressive(max_iterations, max_dice, every, interval, seed, target_se=None):
+    names = []
+    for num_dice in range(2, max_dice + 1):
+        names.append('{0}_dice_total'.format(num_dice))
+        names.append('{0}_dice_failures'.format(num_dice))
+    snapshots = adaptive.progress_snapshots(lambda: maw_sample(max_dice), names, max_iterations, every, interval,
+                                            seed, target_se)
+    adaptive.print_progress(snapshots, sim="maw")
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(prog="RunIntoMaw",
                                      description='Calculate values and success chance for running into maw for KD:M',
                                      add_help=True)
 
     parser.add_argument('--iterations', type=int, help='The number of iterations to run',
                         default=100000)
-
-    args = parser.parse_args()
-
-    maw_sim(args.iterations)
+    parser.add_argument('--max_dice', type=int, help='The largest number of dice to roll', default=6)
+    parser.add_argument('--exact', action='store_true', help='Compute exact results instead of sampling')
+    parser.add_argument('--workers', type=int, help='The number of worker processes to shard iterations across',
+                        default=1)
+    parser.add_argument('--seed', type=int, help='Seed for reproducible runs', default=None)
+    parser.add_argument('--distribution', action='store_true',
+                        help='Print the full sum distribution in exact mode')
+    adaptive.add_adaptive_arguments(parser)
+    results.add_output_arguments(parser)
+
+    args = parser.parse_args(argv)
+    writer = results.open_writer(args)
+
+    if args.exact:
+        maw_exact(args.max_dice, args.distribution, writer)
+    elif adaptive.progress_requested(args):
+        maw_progressive(args.iterations, args.max_dice, args.batch_size, args.progress_seconds, args.seed,
+                        adaptive.target_std_error(args))
+    elif adaptive.target_std_error(args):
+        maw_adaptive(args.iterations, args.max_dice, adaptive.target_std_error(args), args.batch_size, args.seed,
+                     writer)
+    else:
+        maw_sim(args.iterations, args.max_dice, args.workers, args.seed, writer)
+    if writer:
+        writer.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,302 @@
+# server.py
+#
+# Long running local simulation service. Keeps a pool of warm worker
+# processes with the catalogs already loaded, coalesces identical in-flight
+# requests and streams batch results back as newline delimited JSON as each
+# one finishes.
+#
+#   POST /run    one request object, answered with one JSON object
+#   POST /batch  a list of request objects, answered with one JSON line per
+#                request in completion order, each tagged with its index
+#
+# Request objects name the simulator and its options, e.g.
+#   {"sim": "attack", "weapon": "Bone Axe", "character": "Xena", "toughness": 12,
+#    "extra_mods": ["Axe Spec"], "iterations": 100000, "seed": 1}
+#   {"sim": "delving", "max_depth": 2, "sickle": true, "exact": true}
+#   {"sim": "gathering", "players": 4, "max_dice": 6, "iterations": 100000}
+#   {"sim": "maw", "max_dice": 6, "exact": true}
+import argparse
+import BaseHTTPServer
+import json
+import multiprocessing
+import SocketServer
+import sys
+import threading
+
+import attack_exact
+import attack_sim
+import catalog
+import delving
+import dice
+import dice_exact
+import gathering
+import parallel
+import result_cache
+import run_into_maw
+
+
+def trim_chances(chances):
+    # P(wounds >= k) without the run of impossible values at the end
+    while len(chances) > 1 and not chances[-1]:
+        chances = chances[:-1]
+    return chances
+
+
+def request_iterations(request, default):
+    iterations = request.get("iterations", default)
+    if not isinstance(iterations, (int, long)) or isinstance(iterations, bool) or iterations <= 0:
+        raise RuntimeError('iterations must be a positive integer, got: {0}'.format(iterations))
+    return iterations
+
+
+def attack_request(request):
+    weapon = attack_sim.load_weapon_data(request["weapon"])
+    character = attack_sim.load_character_data(request.get("character", "Default"))
+    extra_mods = request.get("extra_mods", [])
+    toughness = request.get("toughness", 12)
+    result = {"warnings": attack_sim.apply_extra_mods(weapon, character, extra_mods)}
+    scale = 2 if "Painted" in extra_mods else 1
+
+    if request.get("exact"):
+        plan = attack_sim.RulePlan(weapon, character, extra_mods)
+        result["unsupported"] = attack_exact.unsupported_mods(plan, toughness)
+        if not result["unsupported"]:
+            exact = attack_exact.evaluate(plan, toughness, scale)
+            result.update(hits=exact.hits, wounds=exact.wounds, early_iron_failure=exact.early_iron_failure,
+                          wounds_at_least=trim_chances(exact.distribution.exceedance(1)), exact=True)
+            return result
+
+    iterations = request_iterations(request, 100000)
+    totals = parallel.run_sharded(attack_sim.attack_totals,
+                                  (weapon, character, toughness, extra_mods, request.get("engine", "python")),
+                                  iterations, 1, request.get("seed"))
+    hits, wounds = attack_sim.expected_results(totals["hits"], totals["wounds"], iterations, extra_mods)
+    result.update(hits=hits, wounds=wounds, early_iron_failure=totals["context"] / iterations,
+                  wounds_at_least=trim_chances(totals["distribution"].exceedance(1)), iterations=iterations)
+    if "instrumentation" in totals:
+        result["instrumentation"] = totals["instrumentation"]
+    return result
+
+
+def delving_request(request):
+    args = (request.get("max_depth", 0), request.get("sickle", False), request.get("whip", False),
+            request.get("almanac", False))
+    if request.get("exact"):
+        return dict(vars(delving.mine_exact(*args)), exact=True)
+
+    iterations = request_iterations(request, 1000000)
+    totals = parallel.run_sharded(delving.mining_totals, args, iterations, 1, request.get("seed"))
+    return dict(((key, value / iterations) for key, value in totals.items()), iterations=iterations)
+
+
+def gathering_request(request):
+    players = request.get("players", 4)
+    max_dice = request.get("max_dice", 6)
+    if request.get("exact"):
+        tables = dict((num_dice, dice_exact.table_distribution(num_dice, players))
+                      for num_dice in range(2, max_dice + 1))
+        thresholds = request.get("thresholds", [])
+        return {"table_total": dict((num_dice, table.mean) for num_dice, table in tables.items()),
+                "percentiles": dict((num_dice, [table.percentile(fraction) for fraction in (0.1, 0.5, 0.9)])
+                                    for num_dice, table in tables.items()),
+                "at_least": dict((num_dice, [table.at_least(threshold) for threshold in thresholds])
+                                 for num_dice, table in tables.items()),
+                "exact": True}
+
+    iterations = request_iterations(request, 100000)
+    totals = parallel.run_sharded(gathering.gathering_totals, (players, max_dice), iterations, 1,
+                                  request.get("seed"))
+    return {"table_total": dict((num_dice, total / iterations) for num_dice, total in totals["table_total"].items()),
+            "iterations": iterations}
+
+
+def maw_request(request):
+    max_dice = request.get("max_dice", 6)
+    if request.get("exact"):
+        distributions = [dice_exact.distinct_sum_distribution(num_dice) for num_dice in range(2, max_dice + 1)]
+        return {"total": dict((dist.num_dice, dist.mean) for dist in distributions),
+                "fail_chance": dict((dist.num_dice, dist.fail_chance) for dist in distributions), "exact": True}
+
+    iterations = request_iterations(request, 100000)
+    totals = parallel.run_sharded(run_into_maw.maw_totals, (max_dice,), iterations, 1, request.get("seed"))
+    return {"total": dict((num_dice, total / iterations) for num_dice, total in totals["total"].items()),
+            "fail_chance": dict((num_dice, failures / iterations)
+                                for num_dice, failures in totals["failures"].items()),
+            "iterations": iterations}
+
+
+SIMULATORS = {
+    "attack": attack_request,
+    "delving": delving_request,
+    "gathering": gathering_request,
+    "maw": maw_request,
+}
+
+
+def check_request(request):
+    if not isinstance(request, dict) or request.get("sim") not in SIMULATORS:
+        raise RuntimeError('Unknown simulator, expected one of: {0}'.format(', '.join(sorted(SIMULATORS))))
+    extra_mods = request.get("extra_mods", [])
+    if not isinstance(extra_mods, list) or not all(isinstance(mod, basestring) for mod in extra_mods):
+        raise RuntimeError('extra_mods must be a list of mod names')
+
+
+def run_request(request):
+    # runs in a worker process, errors are returned rather than raised so one
+    # bad request in a batch doesn't take the others down
+    try:
+        check_request(request)
+        return SIMULATORS[request["sim"]](request)
+    except RuntimeError as error:
+        return {"error": str(error)}
+    except Exception as error:
+        return {"error": '{0}: {1}'.format(type(error).__name__, error)}
+
+
+class SimulationService(object):
+    def __init__(self, workers):
+        # loaded before the pool forks so every worker starts warm
+        catalog.default_catalog().weapon_names()
+        catalog.default_catalog().character_names()
+        # each forked worker reseeds its dice so unseeded requests don't
+        # replay the parent's stream
+        self.pool = multiprocessing.Pool(workers, dice.seed)
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def submit(self, request):
+        key = result_cache.config_key(request)
+        with self.lock:
+            pending = self.in_flight.get(key)
+            # a finished entry is never shared, whether it succeeded or not
+            if pending is None or pending.ready():
+                job = []
+                pending = self.pool.apply_async(run_request, (request,),
+                                                callback=lambda result: self.finished(key, job[0]))
+                job.append(pending)
+                self.in_flight[key] = pending
+            return pending
+
+    def finished(self, key, pending):
+        # a newer job may already have replaced this one under the same key
+        with self.lock:
+            if self.in_flight.get(key) is pending:
+                del self.in_flight[key]
+
+    def result(self, pending):
+        # the callback only runs on success, so a failed job is cleared here
+        try:
+            return pending.get()
+        except Exception as error:
+            with self.lock:
+                for key, value in self.in_flight.items():
+                    if value is pending:
+                        del self.in_flight[key]
+            return {"error": '{0}: {1}'.format(type(error).__name__, error)}
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+class SimulationHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def read_json(self):
+        try:
+            return json.loads(self.rfile.read(int(self.headers.getheader("content-length", 0))))
+        except ValueError as error:
+            self.send_json(400, {"error": str(error)})
+            return None
+
+    def send_json(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(body) + "\n")
+
+    def do_GET(self):
+        if self.path == "/":
+            self.send_json(200, {"status": "ok", "simulators": sorted(SIMULATORS)})
+        else:
+            self.send_json(404, {"error": "Not found: {0}".format(self.path)})
+
+    def do_POST(self):
+        if self.path == "/run":
+            request = self.read_json()
+            if request is None:
+                return
+            try:
+                check_request(request)
+            except RuntimeError as error:
+                self.send_json(400, {"error": str(error)})
+            else:
+                service = self.server.service
+                self.send_json(200, service.result(service.submit(request)))
+        elif self.path == "/batch":
+            requests = self.read_json()
+            if requests is None:
+                return
+            if not isinstance(requests, list):
+                self.send_json(400, {"error": "A batch must be a list of requests"})
+                return
+            self.stream_batch(requests)
+        else:
+            self.send_json(404, {"error": "Not found: {0}".format(self.path)})
+
+    def stream_batch(self, requests):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        pending = [(index, self.server.service.submit(request)) for index, request in enumerate(requests)]
+        while pending:
+            ready = [(index, result) for index, result in pending if result.ready()]
+            if not ready:
+                pending[0][1].wait(0.05)
+                continue
+            for index, result in ready:
+                self.wfile.write(json.dumps({"index": index, "result": self.server.service.result(result)}) + "\n")
+                self.wfile.flush()
+                pending.remove((index, result))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class SimulationServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, SimulationHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="server", description='Serve KD:M simulations over local HTTP',
+                                     add_help=True)
+    parser.add_argument('--host', type=str, help='The address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help='The port to listen on', default=8642)
+    parser.add_argument('--workers', type=int, help='The number of warm worker processes',
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+
+    args = parser.parse_args(argv)
+
+    service = SimulationService(args.workers)
+    server = SimulationServer((args.host, args.port), service, args.verbose)
+    print 'Serving simulations on http://{0}:{1}/ with {2} workers'.format(args.host, server.server_port,
+                                                                          args.workers)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return True
+
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
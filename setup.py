@@ -0,0 +1,51 @@
+# setup.py
+#
+# Installs the simulators as flat modules with a kdm-dice console script.
+# weapon_data.json and characters.json are installed to share/kdm-dice,
+# where catalog looks when they aren't next to its module:
+#   pip install .
+from setuptools import setup
+
+
+setup(
+    name="kdm-dice",
+    version="0.1.0",
+    description="Kingdom Death: Monster python script for calculating dice rolls",
+    license="GPLv3",
+    py_modules=[
+        "adaptive",
+        "attack_exact",
+        "attack_numpy",
+        "attack_sim",
+        "benchmark",
+        "catalog",
+        "compare",
+        "delving",
+        "delving_policy",
+        "dice",
+        "dice_exact",
+        "fight",
+        "gathering",
+        "instrument",
+        "kdm_dice",
+        "loadout_optimizer",
+        "parallel",
+        "rare_events",
+        "result_cache",
+        "results",
+        "run_into_maw",
+        "server",
+        "stats",
+        "sweep",
+        "table_cache",
+        "wound_tables",
+    ],
+    data_files=[
+        ("share/kdm-dice", ["weapon_data.json", "characters.json"]),
+    ],
+    entry_points={
+        "console_scripts": [
+            "kdm-dice = kdm_dice:run",
+        ],
+    },
+)
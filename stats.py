@@ -0,0 +1,206 @@
+# stats.py
+#
+# Streaming statistics and distribution tests shared by the simulators
+import math
+
+
+class RunningStats(object):
+    # Welford's numerically stable running mean and variance
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        # Chan et al. pairwise combination, exact for any split of the samples
+        if not other.count:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std_error(self):
+        if self.count < 2:
+            return float("inf")
+        return (self.variance / self.count) ** 0.5
+
+    def confidence_interval(self, z=1.96):
+        margin = z * self.std_error
+        return self.mean - margin, self.mean + margin
+
+
+class JointHistogram(object):
+    # Fixed size counts of (hits, wounds) pairs. Values at or above the
+    # size land in the last bin, so memory is bounded however many
+    # iterations are recorded and shards can be merged by adding counts.
+    def __init__(self, size=32):
+        self.size = size
+        self.counts = [0] * ((size + 1) * (size + 1))
+
+    def index(self, hits, wounds):
+        return min(int(hits), self.size) * (self.size + 1) + min(int(wounds), self.size)
+
+    def add(self, hits, wounds, count=1):
+        self.counts[self.index(hits, wounds)] += count
+
+    def add_counts(self, counts):
+        for index, count in enumerate(counts):
+            self.counts[index] += count
+
+    def merge(self, other):
+        if other.size != self.size:
+            raise RuntimeError('Cannot merge histograms of size {0} and {1}'.format(self.size, other.size))
+        self.add_counts(other.counts)
+        return self
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def marginal(self, axis):
+        # axis 0 is hits, axis 1 is wounds
+        marginal = [0] * (self.size + 1)
+        for index, count in enumerate(self.counts):
+            marginal[divmod(index, self.size + 1)[axis]] += count
+        return marginal
+
+    def exceedance(self, axis):
+        # P(value >= k) for k = 0..size, the last entry is an overflow bound
+        marginal = self.marginal(axis)
+        total = float(sum(marginal))
+        chances = []
+        remaining = 0
+        # summed from the top so probability weighted counts don't leave
+        # rounding residue in the empty tail
+        for count in reversed(marginal):
+            remaining += count
+            chances.append(remaining / total)
+        chances.reverse()
+        return chances
+
+    def percentile(self, axis, fraction):
+        marginal = self.marginal(axis)
+        target = fraction * sum(marginal)
+        cumulative = 0
+        for value, count in enumerate(marginal):
+            cumulative += count
+            if cumulative >= target:
+                return value
+        return self.size
+
+
+def regularized_gamma_q(a, x):
+    # Upper regularized incomplete gamma function Q(a, x), by series for
+    # small x and Lentz's continued fraction otherwise
+    if x <= 0.0:
+        return 1.0
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1.0:
+        term = 1.0 / a
+        total = term
+        n = a
+        for _ in range(1000):
+            n += 1.0
+            term *= x / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+    tiny = 1e-300
+    b = x + 1.0 - a
+    c = 1.0 / tiny
+    d = 1.0 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2.0
+        d = an * d + b
+        if abs(d) < tiny:
+            d = tiny
+        c = b + an / c
+        if abs(c) < tiny:
+            c = tiny
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-15:
+            break
+    return math.exp(log_prefix) * h
+
+
+def chi_square_p_value(statistic, degrees_of_freedom):
+    if degrees_of_freedom <= 0:
+        return 1.0
+    return regularized_gamma_q(degrees_of_freedom / 2.0, statistic / 2.0)
+
+
+def mean_p_value(mean, expected, std_error):
+    # two sided normal p-value that a sample mean came from expected
+    if not std_error:
+        return 1.0 if abs(mean - expected) < 1e-12 else 0.0
+    return math.erfc(abs(mean - expected) / std_error / math.sqrt(2.0))
+
+
+def pool_sparse_bins(expected_pairs, minimum=5.0):
+    # merges bins with a small expected count so the chi-square
+    # approximation holds, pairs are (expected, observed)
+    pooled = []
+    pending_expected = 0.0
+    pending_observed = 0.0
+    for expected, observed in expected_pairs:
+        pending_expected += expected
+        pending_observed += observed
+        if pending_expected >= minimum:
+            pooled.append((pending_expected, pending_observed))
+            pending_expected = 0.0
+            pending_observed = 0.0
+    if pending_expected or pending_observed:
+        if pooled:
+            expected, observed = pooled.pop()
+            pooled.append((expected + pending_expected, observed + pending_observed))
+        else:
+            pooled.append((pending_expected, pending_observed))
+    return pooled
+
+
+def goodness_of_fit(observed_counts, probabilities):
+    # p-value that observed_counts were drawn from the exact probabilities
+    total = float(sum(observed_counts))
+    pooled = pool_sparse_bins([(probability * total, observed)
+                               for probability, observed in zip(probabilities, observed_counts)])
+    statistic = sum((observed - expected) ** 2 / expected for expected, observed in pooled if expected)
+    return chi_square_p_value(statistic, len(pooled) - 1)
+
+
+def two_sample_test(counts_a, counts_b):
+    # p-value that two sets of binned counts come from the same distribution
+    total_a = float(sum(counts_a))
+    total_b = float(sum(counts_b))
+    total = total_a + total_b
+    # pooled on the smaller sample's share of each combined bin, observed
+    # keeps the per sample counts
+    smaller = min(total_a, total_b) / (total_a + total_b)
+    pooled = pool_sparse_bins([((a + b) * smaller, a) for a, b in zip(counts_a, counts_b) if a or b])
+    statistic = 0.0
+    for expected, a in pooled:
+        both = expected / smaller
+        expected_a = both * total_a / (total_a + total_b)
+        expected_b = both - expected_a
+        statistic += (a - expected_a) ** 2 / expected_a + (both - a - expected_b) ** 2 / expected_b
+    return chi_square_p_value(statistic, len(pooled) - 1)
@@ -0,0 +1,130 @@
+# sweep.py
+#
+# Parameter sweeps for attack_sim over a grid of weapons, characters,
+# extra mods, frenzy levels and monster toughness values.
+#
+# Example grid file:
+# {
+#   "weapons": ["Bone Axe", "Counterweighted Axe"],
+#   "characters": ["Default", "Xena"],
+#   "extra_mods": [[], ["Axe Spec"]],
+#   "frenzy": [0, 1, 2],
+#   "toughness": [10, 12, 14]
+# }
+import argparse
+import copy
+import json
+import sys
+
+import attack_sim
+import parallel
+import results
+
+
+COLUMNS = ["weapon", "character", "extra mods", "frenzy", "toughness", "hits", "wounds", "early iron %"]
+RECORD_COLUMNS = ["weapon", "character", "extra_mods", "frenzy", "toughness", "hits", "wounds",
+                  "early_iron_failure"]
+
+
+def load_grid(path):
+    with open(path, "r") as read_file:
+        grid = json.load(read_file)
+    if "weapons" not in grid:
+        raise RuntimeError('Sweep grid has no weapons: {0}'.format(path))
+    grid.setdefault("characters", ["Default"])
+    grid.setdefault("extra_mods", [[]])
+    grid.setdefault("frenzy", [0])
+    grid.setdefault("toughness", [10, 12, 14])
+    return grid
+
+
+def grid_cells(grid):
+    # toughness is deliberately not part of a cell, every toughness value
+    # is resolved from the same hit rolls inside the cell
+    for weapon_name in grid["weapons"]:
+        for character_name in grid["characters"]:
+            for extra_mods in grid["extra_mods"]:
+                for frenzy in grid["frenzy"]:
+                    yield weapon_name, character_name, list(extra_mods), frenzy
+
+
+def run_cell(weapon, character, extra_mods, frenzy, toughnesses, iterations, workers, seed):
+    weapon = copy.deepcopy(weapon)
+    character = copy.deepcopy(character)
+    for warning in attack_sim.apply_extra_mods(weapon, character, extra_mods):
+        print >> sys.stderr, "WARNING: {0} ({1})".format(warning, weapon.name)
+    character.extra_speed += frenzy
+    character.extra_strength += frenzy
+
+    totals = parallel.run_sharded(attack_sim.attack_totals_by_toughness,
+                                  (weapon, character, toughnesses, extra_mods), iterations, workers, seed)
+    rows = []
+    for toughness in toughnesses:
+        hits, wounds = attack_sim.expected_results(totals["hits"][toughness], totals["wounds"][toughness],
+                                                   iterations, extra_mods)
+        rows.append([weapon.name, character.name, ", ".join(extra_mods), frenzy, toughness, hits, wounds,
+                     totals["context"] / iterations * 100.0])
+    return rows
+
+
+def sweep_record(row, iterations):
+    # one row for results.ResultWriter, early iron as a fraction
+    record = [("sim", "sweep")] + zip(RECORD_COLUMNS, row[:-1] + [row[-1] / 100.0])
+    return record + [("iterations", iterations)]
+
+
+def run_sweep(grid, iterations, workers=1, seed=None, writer=None):
+    weapons = {}
+    characters = {}
+    rows = []
+    for weapon_name, character_name, extra_mods, frenzy in grid_cells(grid):
+        if weapon_name not in weapons:
+            weapons[weapon_name] = attack_sim.load_weapon_data(weapon_name)
+        if character_name not in characters:
+            characters[character_name] = attack_sim.load_character_data(character_name)
+        cell_rows = run_cell(weapons[weapon_name], characters[character_name], extra_mods, frenzy,
+                             grid["toughness"], iterations, workers, seed)
+        if writer:
+            for row in cell_rows:
+                writer.add(sweep_record(row, iterations))
+        rows.extend(cell_rows)
+    return rows
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return '{0:.2f}'.format(value)
+    return str(value)
+
+
+def print_table(rows):
+    table = [COLUMNS] + [[format_value(value) for value in row] for row in rows]
+    widths = [max(len(row[column]) for row in table) for column in range(len(COLUMNS))]
+    for row in table:
+        print '  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="sweep", description='Run attack_sim over a grid of configurations',
+                                     add_help=True)
+    parser.add_argument('grid', type=str, help='JSON file describing the sweep grid')
+    parser.add_argument('--iterations', type=int, help='The number of iterations to run per cell',
+                        default=100000)
+    parser.add_argument('--workers', type=int, help='The number of worker processes to shard iterations across',
+                        default=1)
+    parser.add_argument('--seed', type=int, help='Seed for reproducible runs', default=None)
+    results.add_output_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    grid = load_grid(args.grid)
+    writer = results.open_writer(args)
+    print_table(run_sweep(grid, args.iterations, args.workers, args.seed, writer))
+    if writer:
+        writer.close()
+    return True
+
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
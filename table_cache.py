@@ -0,0 +1,37 @@
+# table_cache.py
+#
+# Bounded least recently used cache for built lookup tables, shared by the
+# attack wound tables and the gathering table distributions.
+
+
+class TableCache(object):
+    # Least recently used cache of built tables, bounded to max_size. Each
+    # entry is [table, last use], and a full cache drops its least recently
+    # used half at once, so a hit is one plain dict lookup.
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.tables = {}
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        self.clock += 1
+        entry = self.tables.get(key)
+        if entry is None:
+            self.misses += 1
+            if len(self.tables) >= self.max_size:
+                self.evict()
+            entry = self.tables[key] = [build(), self.clock]
+        else:
+            self.hits += 1
+            entry[1] = self.clock
+        return entry[0]
+
+    def evict(self):
+        tables = self.tables
+        for key in sorted(tables, key=lambda key: tables[key][1])[:max(len(tables) // 2, 1)]:
+            del tables[key]
+
+    def clear(self):
+        self.tables.clear()
@@ -0,0 +1,51 @@
+# wound_tables.py
+#
+# Memoized per-face hit and wound chances. Whether a die hits only depends
+# on accuracy, and the chance a wound roll wounds only on strength,
+# toughness and the Sharp and Butcher lv3 flags, so each combination is a
+# fixed eleven entry table indexed by the d10 face (index 0 unused). The
+# sampler looks a wound up and settles it with at most one uniform draw
+# instead of rolling the Sharp and Butcher dice, and attack_exact uses the
+# same tables for expectations.
+#
+# Tables live in one LRU cache per process, shared by every RulePlan, so
+# sweep cells reuse each other's tables, and forked workers start with the
+# tables their parent already built.
+import table_cache
+
+
+MAX_TABLES = 4096
+default_cache = table_cache.TableCache(MAX_TABLES)
+
+
+def build_hit_table(acc):
+    return tuple(face == 10 or (face > 1 and face >= acc) for face in range(11))
+
+
+def face_wound_chance(face, str, toughness, sharp, butcher):
+    if face == 1:
+        return 0.0
+    if face == 10:
+        return 1.0
+    if sharp:
+        # the Sharp die adds 1-10 strength
+        chance = min(max(face + str + 10 - toughness + 1, 0), 10) / 10.0
+    else:
+        chance = 1.0 if face + str >= toughness else 0.0
+    if butcher:
+        # cancelled on a 8+
+        chance *= 0.7
+    return chance
+
+
+def build_wound_table(str, toughness, sharp, butcher):
+    return (0.0,) + tuple(face_wound_chance(face, str, toughness, sharp, butcher) for face in range(1, 11))
+
+
+def hit_table(acc, cache=default_cache):
+    return cache.get(("hit", acc), lambda: build_hit_table(acc))
+
+
+def wound_table(str, toughness, sharp, butcher, cache=default_cache):
+    return cache.get(("wound", str, toughness, bool(sharp), bool(butcher)),
+                     lambda: build_wound_table(str, toughness, sharp, butcher))